@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+loopback microbenchmark: cost of one request against the size of the file
+
+for every --words size it writes a words file of that many words, starts
+./server on 127.0.0.1 and times --requests stop-and-wait "p,k\\n" requests over
+one connection, then sends STOP. prints microseconds per request for every
+(words, k); the server tokenizes the file once at startup, so the cost should
+not grow with the file, only with k.
+
+    make build && python3 bench_server.py --words 1000 10000 100000 1000000 --k 1 10 100
+"""
+import argparse
+import json
+import socket
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from readiness import wait_ready, stop
+
+HOST = "127.0.0.1"
+
+
+def write_words(path, n):
+    path.write_text(",".join(f"word{i % 1000}" for i in range(n)) + "\n")
+    return path.stat().st_size
+
+
+def ask(sock, message):
+    sock.sendall(message)
+    reply = b""
+    while not reply.endswith(b"\n"):
+        data = sock.recv(1 << 20)
+        if not data:
+            raise ConnectionError("server closed the connection")
+        reply += data
+    return reply
+
+
+def bench(server, words_file, n_words, k, requests, port):
+    """
+    microseconds per request, averaged over requests
+    """
+    config = Path(words_file.parent) / "config.json"
+    config.write_text(json.dumps({"server_ip": HOST, "server_port": port, "filename": str(words_file)}))
+    proc = subprocess.Popen([server, "--config", str(config)], stdout=subprocess.PIPE)
+    try:
+        if not wait_ready(proc, timeout=60):
+            raise RuntimeError(f"{server} did not start")
+        with socket.create_connection((HOST, port)) as sock:
+            messages = [f"{(i * k) % n_words},{k}\n".encode() for i in range(requests)]
+            start = time.perf_counter()
+            for message in messages:
+                ask(sock, message)
+            elapsed = time.perf_counter() - start
+            sock.sendall(b"STOP")
+        return elapsed / requests * 1e6
+    finally:
+        stop(proc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time part1 server requests against the size of the words file")
+    parser.add_argument("--server", default="./server")
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=9700)
+    args = parser.parse_args()
+
+    print(f"{'words':>9} {'bytes':>10} {'k':>5} {'us/request':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        words_file = Path(tmp) / "words.txt"
+        port = args.port
+        for n_words in args.words:
+            size = write_words(words_file, n_words)
+            for k in args.k:
+                us = bench(args.server, words_file, n_words, k, args.requests, port)
+                print(f"{n_words:>9} {size:>10} {k:>5} {us:>11.1f}", flush=True)
+                port += 1
+
+
+if __name__ == "__main__":
+    main()
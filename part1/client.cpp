@@ -13,6 +13,8 @@
 #include <fstream>
 #include <sstream>
 #include <chrono>
+#include <cmath>
+#include <cstdint>
 
 using namespace std;
 using namespace std::chrono;
@@ -124,6 +126,56 @@ void print_freq(string message) {
 
 }
 
+/**
+ * @brief log-bucketed latency histogram, same buckets as latency.py so the
+ * LATENCY_HIST line can be merged with the python clients' histograms
+ */
+const int SUB_BITS = 7;
+const int HALF = (1 << SUB_BITS) / 2;
+const int MAX_BITS = 40;
+const int N_BUCKETS = (MAX_BITS - SUB_BITS + 2) * HALF;
+
+int bucket_of(uint64_t us) {
+    int bits = 64 - __builtin_clzll(us | 1);
+    if (us == 0 || bits <= SUB_BITS) return (int) us;
+    int shift = bits - SUB_BITS;
+    return min(shift * HALF + (int) (us >> shift), N_BUCKETS - 1);
+}
+
+uint64_t bucket_value(int index) {
+    if (index < 2 * HALF) return index;
+    int shift = index / HALF - 1;
+    return ((uint64_t) (index - shift * HALF + 1) << shift) - 1;
+}
+
+/**
+ * @brief latency (us) at or below which q percent of the requests completed
+ */
+uint64_t percentile(const vector<uint64_t> &hist, uint64_t total, uint64_t max_us, double q) {
+    if (total == 0) return 0;
+    uint64_t rank = max<uint64_t>(1, (uint64_t) ceil(total * q / 100));
+    uint64_t seen = 0;
+    for (int i = 0; i < N_BUCKETS; i++) {
+        seen += hist[i];
+        if (seen >= rank) return min(bucket_value(i), max_us);
+    }
+    return max_us;
+}
+
+void print_latency(const vector<uint64_t> &hist, uint64_t total, uint64_t max_us) {
+    cout << "LATENCY_US n=" << total;
+    for (double q : {50.0, 90.0, 99.0, 99.9}) {
+        cout << " p" << q << "=" << percentile(hist, total, max_us, q);
+    }
+    cout << " max=" << max_us << endl;
+
+    cout << "LATENCY_HIST:";
+    for (int i = 0; i < N_BUCKETS; i++) {
+        if (hist[i]) cout << i << ":" << hist[i] << ",";
+    }
+    cout << "max:" << max_us << endl;
+}
+
 /**
  *@brief parses the file and finds out if there actually is some EOF token
  */
@@ -196,6 +248,8 @@ int main(int argc, char * argv[]) {
     }
     
     double file_download_time = 0;
+    vector<uint64_t> latency_hist(N_BUCKETS, 0);
+    uint64_t latency_total = 0, latency_max = 0;
     string full_doc = "";
     // cout << "p=" << p << "," << "k=" << k << endl;
     // cout << config_file << endl;
@@ -229,6 +283,11 @@ int main(int argc, char * argv[]) {
 
         file_download_time += delta;
 
+        uint64_t delta_us = (uint64_t) (delta * 1000);
+        latency_hist[bucket_of(delta_us)]++;
+        latency_total++;
+        latency_max = max(latency_max, delta_us);
+
         full_doc += recv_message;
         if (!quiet) {
             print_freq(recv_message);
@@ -250,6 +309,7 @@ int main(int argc, char * argv[]) {
 
     /*diplaying ELAPSED_MS*/
     cout << "ELAPSED_MS:" << file_download_time << endl;
+    print_latency(latency_hist, latency_total, latency_max);
 
     /* clolsing the client socket */
     close(client_socket_fd);
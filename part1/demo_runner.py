@@ -1,24 +1,33 @@
 # demo_runner.py
-import json, os, time, pathlib
-from topo_wordcount import make_net
+import json, os, pathlib
+from readiness import wait_ready, stop
+from backend import LoopbackNet
 
 K = int(os.environ.get("K", "5"))
 P = int(os.environ.get("P", "0"))
+# "loopback" runs without root or mininet (backend.py)
+BACKEND = os.environ.get("BACKEND", "mininet")
+
+if BACKEND == "loopback":
+    net = LoopbackNet()
+else:
+    from topo_wordcount import make_net
+    net = make_net()
+net.start()
+h1, h2 = net.get('h1'), net.get('h2')
 
 # load base config and override p
 cfg = json.loads(pathlib.Path("config.json").read_text())
 cfg["p"] = P
+cfg["server_ip"] = h2.IP()
 pathlib.Path("demo_config.json").write_text(json.dumps(cfg))
 
-net = make_net(); net.start()
-h1, h2 = net.get('h1'), net.get('h2')
-
 # start server with demo config
-srv = h2.popen("./server --config demo_config.json", shell=True)
-# print(srv.stdout.readline())
-time.sleep(0.5)
+srv = h2.popen("./server --config demo_config.json")
+if not wait_ready(srv):
+    print("server did not start")
 
 # run client once (no --quiet): prints word frequencies + ELAPSED_MS
 print(h1.cmd(f"./client  --config demo_config.json --k {K} --p {P}"))
 
-srv.terminate(); time.sleep(0.2); net.stop()
+stop(srv); net.stop()
@@ -1,19 +1,25 @@
 # STARTER CODE ONLY. EDIT AS DESIRED
 #!/usr/bin/env python3
 import re
-import time
 import csv
 from pathlib import Path
-from topo_wordcount import make_net
 import json
+import argparse
+from latency import LatencyHistogram, from_output, PERCENTILES
+from readiness import wait_ready, stop
+from backend import BACKENDS, LoopbackNet
 
 # Config
 K_VALUES = [1, 2, 5, 10, 20, 50, 100]#, 200, 400, 800]   
 RUNS_PER_K = 5
-SERVER_CMD = "./server --config config.json"
-CLIENT_CMD_TMPL = "./client --config config.json "
+SERVER_CMD = "./server --config {config}"
+CLIENT_CMD_TMPL = "./client --config {config} "
+# what the loopback backend runs from, config.json keeps the mininet server_ip
+LOOPBACK_CONFIG = "loopback_config.json"
 
 RESULTS_CSV = Path("results.csv")
+# per-request latency percentiles (us) of every run, and merged over the runs of each k
+LATENCY_CSV = Path("latency.csv")
 
 def modify_config(
         key:str, 
@@ -49,7 +55,12 @@ def get_val(
     return value
 
 
-def main():
+def write_latency(k, r, hist):
+    with LATENCY_CSV.open("a", newline="") as f:
+        csv.writer(f).writerow([k, r, hist.total] + list(hist.percentiles().values()))
+
+
+def main(backend="mininet"):
 
     RUNS_PER_K = get_val("num_iterations")
 
@@ -57,30 +68,48 @@ def main():
     with RESULTS_CSV.open("w", newline="") as f:
         w = csv.writer(f)
         w.writerow(["k", "run", "elapsed_ms"])
-
-    net = make_net()
+    with LATENCY_CSV.open("w", newline="") as f:
+        csv.writer(f).writerow(["k", "run", "requests"] + [f"p{q:g}" for q in PERCENTILES] + ["max"])
+    merged = {}  # k -> latencies over all runs
+
+    if backend == "loopback":
+        net = LoopbackNet()
+    else:
+        from topo_wordcount import make_net
+        net = make_net()
     net.start()
 
     h1 = net.get('h1')  # client
     h2 = net.get('h2')  # server
 
+    config = "config.json"
+    if backend == "loopback":
+        config = LOOPBACK_CONFIG
+        Path(config).write_text(Path("config.json").read_text())
+        modify_config("server_ip", h2.IP(), config)
+
     # Ensure words.txt exists (shared FS)
     if not Path("words.txt").exists():
         Path("words.txt").write_text("cat,bat,cat,dog,dog,emu,emu,emu,ant\n")
 
 
+    # set before the try, so an error ahead of the first server is not hidden by the finally
+    srv = None
     try:
         for k in K_VALUES:
             for r in range(1, RUNS_PER_K + 1):
 
                 # print(f"k={k},r={r}")
-                modify_config("k", k) # should implement this function
+                modify_config("k", k, config) # should implement this function
                 
                 # Start server
-                srv = h2.popen(SERVER_CMD, shell=True)
-                time.sleep(0.5)  # give it a moment to bind                
+                srv = h2.popen(SERVER_CMD.format(config=config))
+                if not wait_ready(srv):
+                    print(f"[warn] Server did not start for k={k} run={r}")
+                    stop(srv)
+                    continue
 
-                cmd = CLIENT_CMD_TMPL
+                cmd = CLIENT_CMD_TMPL.format(config=config)
                 # this is just command line stuff, executes and closes
                 out = h1.cmd(cmd)
                 
@@ -88,18 +117,26 @@ def main():
                 m = re.search(r"ELAPSED_MS:(\d+)", out)
                 if not m:
                     print(f"[warn] No ELAPSED_MS found for k={k} run={r}. Raw:\n{out}")
+                    stop(srv)
                     continue
                 ms = int(m.group(1))
                 with RESULTS_CSV.open("a", newline="") as f:
                     csv.writer(f).writerow([k, r, ms])
                 print(f"k={k} run={r} elapsed_ms={ms}")
+                hist = from_output(out)
+                merged.setdefault(k, LatencyHistogram()).merge(hist)
+                write_latency(k, r, hist)
                 print(out)
-                srv.terminate()
-                time.sleep(0.2)
+                stop(srv)
+            if k in merged:
+                write_latency(k, "all", merged[k])
     finally:
-        srv.terminate()
-        time.sleep(0.2)
+        if srv is not None:
+            stop(srv)
         net.stop()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=BACKENDS, default="mininet", help="loopback runs the hosts as local processes on 127.0.0.x, without root (backend.py)")
+    args = parser.parse_args()
+    main(args.backend)
@@ -5,6 +5,9 @@
 #include <netdb.h>
 #include <unistd.h>
 #include <sys/types.h>
+#include <sys/uio.h>
+#include <sys/epoll.h>
+#include <fcntl.h>
 #include <stdlib.h>
 #include <cstring>
 #include <vector>
@@ -12,6 +15,10 @@
 #include <arpa/inet.h>
 #include <fstream>
 #include <sstream>
+#include <unordered_map>
+#include <climits>
+#include <cerrno>
+#include <csignal>
 
 using namespace std;
 
@@ -98,42 +105,265 @@ vector<string> split(string s, char delimiter) {
     return words;
 }
 
-string handle_request(string message, string words) {
-    vector<string> words_vector = split(words, ',');
+/**
+ * @brief the words of the file, tokenized once at startup. joined holds them
+ * separated by single commas and word i is joined[offset[i], offset[i]+length[i]),
+ * so the words of any request are one contiguous range of joined
+ */
+struct WordIndex {
+    string joined;
+    vector<size_t> offset;
+    vector<size_t> length;
+};
+
+WordIndex build_index(const string &words) {
+    WordIndex index;
+    for (const string &word : split(words, ',')) {
+        if (!index.offset.empty()) index.joined += ",";
+        index.offset.push_back(index.joined.size());
+        index.length.push_back(word.size());
+        index.joined += word;
+    }
+    return index;
+}
+
+/**
+ * @brief points iov at the reply to "p,k": the range of words p..p+k-1 in
+ * index.joined and the "\n" or ",EOF\n" after it, nothing is copied
+ * 
+ * @return number of iovecs used, to be sent with a single writev
+ */
+int handle_request(const string &message, const WordIndex &index, struct iovec iov[2]) {
+    static const string eof = "EOF\n", eof_tail = ",EOF\n", tail = "\n";
 
     vector<string> p_and_k = split(message, ',');
-    int p = stoi(p_and_k[0]), k = stoi(p_and_k[1]);
+    int p = stoi(p_and_k.at(0)), k = stoi(p_and_k.at(1));
+    int n = static_cast<int>(index.offset.size());
     
-    if (p >= words_vector.size()) {
-        return "EOF\n";
+    if (p < 0 || p >= n) {
+        iov[0] = {(void *) eof.data(), eof.size()};
+        return 1;
     }
 
-    string req_words = "";
+    int j = min<int>(p+k, n);
+    size_t begin = index.offset[p];
+    size_t end = (j > p) ? index.offset[j-1] + index.length[j-1] : begin;
+    iov[0] = {(void *) (index.joined.data() + begin), end - begin};
+
+    const string &after = ((p+k) > n) ? eof_tail : tail;
+    iov[1] = {(void *) after.data(), after.size()};
+    return 2;
+}
+
+bool end_service(string message) {
+    if (message=="STOP") return true;
+    return false;
+}
+
+
+/* set by SIGINT/SIGTERM, the epoll loop returns once it sees it */
+volatile sig_atomic_t stop_requested = 0;
 
-    int j = min<int>(p+k, static_cast<int>(words_vector.size()));
-    for (int i = p; i < j; i++) {
-        req_words += words_vector[i];
-        if (i!=(j-1)) {
-            req_words += ",";
+void on_stop_signal(int) {
+    stop_requested = 1;
+}
+
+/* stop reading from a client once this many reply bytes wait to be sent */
+const size_t HIGH_WATER = 256 * 1024;
+
+/**
+ * @brief a client of the epoll mode: bytes read but not yet framed into a
+ * line, and reply bytes the non-blocking socket has not taken yet
+ */
+struct Connection {
+    string in;
+    string out;
+    size_t out_sent = 0;
+    uint32_t events = EPOLLIN;
+
+    size_t pending() const { return out.size() - out_sent; }
+};
+
+/**
+ * @brief writes as much of the pending replies as the socket takes
+ * 
+ * @return false on a socket error
+ */
+bool flush(int fd, Connection &conn) {
+    while (conn.pending() > 0) {
+        ssize_t sent = write(fd, conn.out.data() + conn.out_sent, conn.pending());
+        if (sent < 0) return errno == EAGAIN || errno == EWOULDBLOCK;
+        conn.out_sent += sent;
+    }
+    conn.out.clear();
+    conn.out_sent = 0;
+    return true;
+}
+
+/**
+ * @brief sends replies with as few writev calls as possible, whatever the
+ * socket does not take is copied to conn.out; replies go straight to
+ * conn.out while earlier ones are still waiting there, to keep their order
+ * 
+ * @return false on a socket error
+ */
+bool send_replies(int fd, Connection &conn, vector<struct iovec> &iov) {
+    size_t i = 0;
+    while (conn.pending() == 0 && i < iov.size()) {
+        int iovcnt = min<size_t>(iov.size() - i, IOV_MAX);
+        ssize_t sent = writev(fd, &iov[i], iovcnt);
+        if (sent < 0) {
+            if (errno == EAGAIN || errno == EWOULDBLOCK) break;
+            return false;
+        }
+        /* empty buffers (a reply with no words) are skipped here as well */
+        while (i < iov.size() && (size_t) sent >= iov[i].iov_len) {
+            sent -= iov[i].iov_len;
+            i++;
+        }
+        if (sent > 0) {
+            iov[i].iov_base = (char *) iov[i].iov_base + sent;
+            iov[i].iov_len -= sent;
+            break;
         }
     }
-    if ((p+k)>words_vector.size()) {
-        req_words += ",EOF";
+    for (; i < iov.size(); i++) {
+        conn.out.append((const char *) iov[i].iov_base, iov[i].iov_len);
     }
+    return true;
+}
 
-    req_words += "\n";
+enum ServeResult { SERVE_OK, SERVE_STOP, SERVE_ERROR };
 
-    return req_words;
-    
+/**
+ * @brief answers every complete "p,k\n" line in conn.in with one batch of
+ * replies, a partial line stays in conn.in for the next read. a STOP line
+ * stops the server once the replies before it are sent
+ */
+ServeResult serve_lines(int fd, Connection &conn, const WordIndex &words) {
+    static const string invalid = "ERROR: Invalid request\n";
+
+    vector<struct iovec> iov;
+    ServeResult result = SERVE_OK;
+    size_t start = 0, newline;
+    while ((newline = conn.in.find('\n', start)) != string::npos) {
+        string line = conn.in.substr(start, newline - start);
+        start = newline + 1;
+        if (!line.empty() && line.back() == '\r') line.pop_back();
+        if (end_service(line)) {
+            result = SERVE_STOP;
+            break;
+        }
+        struct iovec reply[2];
+        int iovcnt;
+        try {
+            iovcnt = handle_request(line, words, reply);
+        } catch (const exception &) {
+            reply[0] = {(void *) invalid.data(), invalid.size()};
+            iovcnt = 1;
+        }
+        iov.insert(iov.end(), reply, reply + iovcnt);
+    }
+    conn.in.erase(0, start);
+    if (!send_replies(fd, conn, iov)) return SERVE_ERROR;
+    return result;
 }
 
-bool end_service(string message) {
-    if (message=="STOP") return true;
-    return false;
+/**
+ * @brief serves any number of concurrent clients from one epoll loop until a
+ * client sends a STOP line or the process gets SIGINT/SIGTERM
+ */
+void serve_epoll(int server_socket_fd, const WordIndex &words) {
+    struct sigaction action = {};
+    action.sa_handler = on_stop_signal;
+    /* no SA_RESTART: epoll_wait has to return with EINTR */
+    sigaction(SIGINT, &action, nullptr);
+    sigaction(SIGTERM, &action, nullptr);
+    /* a client closing with replies still queued makes write fail with EPIPE
+       instead of killing the server; only that connection is closed */
+    signal(SIGPIPE, SIG_IGN);
+
+    fcntl(server_socket_fd, F_SETFL, fcntl(server_socket_fd, F_GETFL) | O_NONBLOCK);
+    int epoll_fd = epoll_create1(0);
+    struct epoll_event event = {};
+    event.events = EPOLLIN;
+    event.data.fd = server_socket_fd;
+    epoll_ctl(epoll_fd, EPOLL_CTL_ADD, server_socket_fd, &event);
+
+    unordered_map<int, Connection> clients;
+    vector<struct epoll_event> ready(256);
+    bool running = true;
+
+    while (running && !stop_requested) {
+        int n = epoll_wait(epoll_fd, ready.data(), ready.size(), -1);
+        if (n < 0) {
+            if (errno == EINTR) continue;
+            cerr << "ERROR: epoll_wait\n";
+            break;
+        }
+        for (int e = 0; e < n && running; e++) {
+            int fd = ready[e].data.fd;
+
+            if (fd == server_socket_fd) {
+                /* drain the accept backlog in one go */
+                while (true) {
+                    int client_socket_fd = accept4(server_socket_fd, nullptr, nullptr, SOCK_NONBLOCK);
+                    if (client_socket_fd < 0) break;
+                    event.events = EPOLLIN;
+                    event.data.fd = client_socket_fd;
+                    epoll_ctl(epoll_fd, EPOLL_CTL_ADD, client_socket_fd, &event);
+                    clients[client_socket_fd] = Connection();
+                }
+                continue;
+            }
+
+            Connection &conn = clients[fd];
+            bool ok = true;
+            if (ready[e].events & EPOLLOUT) {
+                ok = flush(fd, conn);
+            }
+            if (ok && (ready[e].events & (EPOLLIN | EPOLLHUP | EPOLLERR))) {
+                char recv_buffer[65536];
+                ssize_t index = read(fd, recv_buffer, sizeof(recv_buffer));
+                if (index > 0) {
+                    conn.in.append(recv_buffer, index);
+                    ServeResult result = serve_lines(fd, conn, words);
+                    if (result == SERVE_STOP) running = false;
+                    ok = result != SERVE_ERROR;
+                } else if (index == 0 || (errno != EAGAIN && errno != EWOULDBLOCK)) {
+                    /* client closed the connection, or it broke */
+                    ok = false;
+                }
+            }
+            if (!ok) {
+                epoll_ctl(epoll_fd, EPOLL_CTL_DEL, fd, nullptr);
+                close(fd);
+                clients.erase(fd);
+                continue;
+            }
+
+            /* read unless paused by HIGH_WATER, write only while replies wait */
+            uint32_t events = (conn.pending() < HIGH_WATER ? EPOLLIN : 0) | (conn.pending() > 0 ? EPOLLOUT : 0);
+            if (events != conn.events) {
+                conn.events = events;
+                event.events = events;
+                event.data.fd = fd;
+                epoll_ctl(epoll_fd, EPOLL_CTL_MOD, fd, &event);
+            }
+        }
+    }
+
+    cout << "Stopping, closing " << clients.size() << " connections" << endl;
+    for (auto &client : clients) {
+        close(client.first);
+    }
+    close(epoll_fd);
 }
 
 int main(int argc, char *argv[]) {
     string config_file = "config.json";
+    /* "single" serves one client and exits, "epoll" many until STOP or a signal */
+    string engine = "";
 
     for (int i = 1; i < argc; i++) {
         string flag = argv[i];
@@ -142,19 +372,28 @@ int main(int argc, char *argv[]) {
             config_file = argv[i+1];
             i++;
         }
+        if (flag=="--engine") {
+            engine = argv[i+1];
+            i++;
+        }
     }
 
     
     
     map<string, string> info = parse_json(config_file);
+    if (engine.empty()) {
+        engine = info.count("engine") ? info["engine"] : "single";
+    }
     string filename=info["filename"];
-    /* init the words */
-    string words = file_to_string(filename);
+    /* init the words, tokenized once instead of on every request */
+    WordIndex words = build_index(file_to_string(filename));
     
     int port=stoi(info["server_port"]);
     
     /* opening a socket at server can check if inside a function this works or not */
     int server_socket_fd = socket(AF_INET, SOCK_STREAM, 0);
+    int reuse = 1;
+    setsockopt(server_socket_fd, SOL_SOCKET, SO_REUSEADDR, &reuse, sizeof(reuse));
     
     /* now we prepare the server */
     struct sockaddr_in server_addr;
@@ -168,8 +407,16 @@ int main(int argc, char *argv[]) {
         cerr << "ERROR: in binding\n";
         exit(1);
     }
-    /* listen on all of the ports */
-    listen(server_socket_fd, 5);
+    /* listen on all of the ports, the epoll engine takes many clients at once */
+    listen(server_socket_fd, engine == "epoll" ? SOMAXCONN : 5);
+    /* the runners wait for this line before starting the client */
+    cout << "Listening on port " << port << endl;
+
+    if (engine == "epoll") {
+        serve_epoll(server_socket_fd, words);
+        close(server_socket_fd);
+        return 0;
+    }
 
     /* accept message from the client */
     struct sockaddr_in client_addr;
@@ -193,11 +440,11 @@ int main(int argc, char *argv[]) {
 
         if (end_service(recv_message)) break;
 
-        string send_message = handle_request(recv_message, words);
+        struct iovec iov[2];
+        int iovcnt = handle_request(recv_message, words, iov);
 
         /* sending the request */
-        const char * send_buffer = send_message.c_str();
-        index = write(client_socket_fd, send_buffer, send_message.size());
+        index = writev(client_socket_fd, iov, iovcnt);
         if (index < 0) {
             cerr << "ERROR: write to socket\n";
             exit(1);
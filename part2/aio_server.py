@@ -0,0 +1,158 @@
+"""
+asyncio engine for the word server
+
+every client is a WordProtocol on a single event loop instead of a thread; the
+"p,k\\n" -> "w1,...,wk[,EOF]\\n" handling (and the binary protocol, see wire.py)
+is the same as the threaded servers.
+requests are answered by one of three policies:
+
+    direct   answered as soon as they are parsed (part2 select server)
+    fcfs     one global arrival-order queue drained by a coroutine (part3)
+    rr       one queue per client, a coroutine serves backlogged clients in turn (part4)
+
+writes go to the transport buffer; once it passes the high watermark the
+protocol stops reading from that client until the buffer drains below the low
+watermark, so a client that does not read cannot grow the server without bound
+"""
+import asyncio
+from collections import deque
+from wire import RequestParser, reply
+
+HIGH_WATER = 64 * 1024
+LOW_WATER = 16 * 1024
+
+
+def corpus_responder(server):
+    """
+    respond(request) for the FCFS/RR servers: invalid requests get no reply.
+    reads server.corpus every time, so a reload of the words takes effect
+    """
+    return lambda request: reply(server.corpus, request)
+
+
+class WordProtocol(asyncio.Protocol):
+    def __init__(self, scheduler, high_water, low_water):
+        self.scheduler = scheduler
+        self.high_water = high_water
+        self.low_water = low_water
+        self.transport = None
+        self.parser = RequestParser()
+        # pending requests, only used by the rr policy
+        self.pending = deque()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.high_water, low=self.low_water)
+
+    def data_received(self, data):
+        for request in self.parser.feed(data):
+            self.scheduler.submit(self, request)
+
+    def connection_lost(self, exc):
+        self.scheduler.drop(self)
+        self.transport = None
+
+    def pause_writing(self):
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.transport.resume_reading()
+
+    def send(self, buffers):
+        if self.transport is not None and not self.transport.is_closing() and buffers:
+            self.transport.writelines(buffers)
+
+
+class DirectScheduler:
+    def __init__(self, respond):
+        self.respond = respond
+
+    def submit(self, proto, request):
+        proto.send(self.respond(request))
+
+    def drop(self, proto):
+        return
+
+    async def run(self):
+        return
+
+
+class FCFSScheduler:
+    def __init__(self, respond):
+        self.respond = respond
+        self.queue = asyncio.Queue()
+
+    def submit(self, proto, request):
+        self.queue.put_nowait((proto, request))
+
+    def drop(self, proto):
+        # queued requests of a closed client are skipped by send()
+        return
+
+    async def run(self):
+        while True:
+            proto, request = await self.queue.get()
+            proto.send(self.respond(request))
+
+
+class RoundRobinScheduler:
+    def __init__(self, respond):
+        self.respond = respond
+        # clients with at least one pending request, in service order
+        self.active = deque()
+        self.wakeup = asyncio.Event()
+
+    def submit(self, proto, request):
+        if not proto.pending:
+            self.active.append(proto)
+            self.wakeup.set()
+        proto.pending.append(request)
+
+    def drop(self, proto):
+        if proto.pending:
+            proto.pending.clear()
+            self.active.remove(proto)
+
+    async def run(self):
+        while True:
+            if not self.active:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            proto = self.active.popleft()
+            proto.send(self.respond(proto.pending.popleft()))
+            if proto.pending:
+                self.active.append(proto)
+            # let the loop read from sockets between turns
+            await asyncio.sleep(0)
+
+
+SCHEDULERS = {"direct": DirectScheduler, "fcfs": FCFSScheduler, "rr": RoundRobinScheduler}
+
+
+async def serve(respond, host, port, policy="fcfs", high_water=HIGH_WATER, low_water=LOW_WATER, name="Word", sock=None):
+    """
+    sock: an already bound listening socket, used instead of host/port
+    """
+    scheduler = SCHEDULERS[policy](respond)
+    loop = asyncio.get_running_loop()
+    factory = lambda: WordProtocol(scheduler, high_water, low_water)
+    if sock is not None:
+        sock.setblocking(False)
+        server = await loop.create_server(factory, sock=sock, backlog=1024)
+    else:
+        server = await loop.create_server(factory, host, port, reuse_address=True, backlog=1024)
+    print(f"{name} Server listening on port {port} (asyncio, {policy})", flush=True)
+    async with server:
+        await asyncio.gather(server.serve_forever(), scheduler.run())
+
+
+def run(respond, host, port, policy="fcfs", config=None, name="Word", sock=None):
+    config = config or {}
+    try:
+        asyncio.run(serve(
+            respond, host, port, policy,
+            config.get("write_high_water", HIGH_WATER), config.get("write_low_water", LOW_WATER), name, sock,
+        ))
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
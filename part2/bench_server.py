@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+loopback benchmark for the part2 word server
+
+starts server.py on 127.0.0.1 with each engine and drives N concurrent
+connections from a single selector loop, every connection doing
+stop-and-wait "p,k\\n" requests. prints requests/sec per (engine, connections).
+
+    python3 bench_server.py --engines select epoll --connections 10 100 1000 5000
+
+for --workers N the load is split over --load-procs generator processes so the
+client side is not the bottleneck
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from readiness import stop
+
+HOST = "127.0.0.1"
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def start_server(engine, port, words_file, workers=1):
+    config = {"server_ip": HOST, "server_port": port, "filename": str(words_file)}
+    cfg = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+    json.dump(config, cfg)
+    cfg.close()
+    srv = subprocess.Popen(
+        [sys.executable, "server.py", "--config", cfg.name, "--engine", engine, "--workers", str(workers)],
+        cwd=Path(__file__).parent, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    # wait for the listening socket
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=0.2).close()
+            return srv
+        except OSError:
+            time.sleep(0.05)
+    stop(srv)
+    raise RuntimeError(f"server ({engine}) did not come up on port {port}")
+
+
+def run_load(port, n_connections, duration, k, n_words):
+    sel = selectors.DefaultSelector()
+    conns = []
+    for i in range(n_connections):
+        s = socket.create_connection((HOST, port))
+        s.setblocking(False)
+        state = {"sock": s, "p": (i * k) % n_words, "buf": b""}
+        sel.register(s, selectors.EVENT_READ, state)
+        conns.append(state)
+
+    def send_next(state):
+        state["sock"].send(f"{state['p']},{k}\n".encode())
+        state["p"] = (state["p"] + k) % n_words
+
+    for state in conns:
+        send_next(state)
+
+    done = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        for key, _ in sel.select(timeout=0.5):
+            state = key.data
+            data = state["sock"].recv(65536)
+            if not data:
+                raise RuntimeError("server closed a connection")
+            state["buf"] += data
+            while b"\n" in state["buf"]:
+                _, state["buf"] = state["buf"].split(b"\n", 1)
+                done += 1
+                send_next(state)
+    elapsed = time.perf_counter() - start
+
+    for state in conns:
+        sel.unregister(state["sock"])
+        state["sock"].close()
+    sel.close()
+    return done / elapsed
+
+
+def run_load_split(port, n_connections, duration, k, n_words, procs):
+    """
+    same as run_load, with the connections spread over procs processes
+    """
+    if procs <= 1:
+        return run_load(port, n_connections, duration, k, n_words)
+    shares = [n_connections // procs + (i < n_connections % procs) for i in range(procs)]
+    with multiprocessing.Pool(procs) as pool:
+        rates = pool.starmap(run_load, [(port, n, duration, k, n_words) for n in shares if n])
+    return sum(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback requests/sec benchmark for part2/server.py")
+    parser.add_argument("--engines", nargs="+", default=["select", "epoll", "asyncio"])
+    parser.add_argument("--connections", nargs="+", type=int, default=[10, 100, 1000, 5000])
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of load per point")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--words", default="words.txt")
+    parser.add_argument("--port", type=int, default=9500)
+    parser.add_argument("--workers", type=int, default=1, help="server processes (SO_REUSEPORT)")
+    parser.add_argument("--load-procs", type=int, default=1, help="load generator processes")
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    words_file = Path(args.words).resolve()
+    n_words = len(words_file.read_text().split(","))
+
+    print("engine,workers,connections,req_per_s")
+    port = args.port
+    for engine in args.engines:
+        for n in args.connections:
+            port += 1
+            if 2 * n + 16 > fd_limit:
+                print(f"{engine},{args.workers},{n},skipped (fd limit {fd_limit})")
+                continue
+            srv = start_server(engine, port, words_file, args.workers)
+            try:
+                rps = run_load_split(port, n, args.duration, args.k, n_words, args.load_procs)
+                print(f"{engine},{args.workers},{n},{rps:.0f}", flush=True)
+            except (OSError, RuntimeError) as e:
+                print(f"{engine},{args.workers},{n},failed ({e})", flush=True)
+            finally:
+                # SIGTERM first, so a --workers supervisor reaps its workers before the next port
+                stop(srv)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,65 @@ import socket
 import argparse
 import json
 import time
+from collections import deque
+from wire import REQUEST, FLAG_EOF, FrameReader, LineReader, negotiate
+from latency import LatencyHistogram
 
-def main(config):
+def download(s, p, k, window, binary, hist):
+    """
+    keeps up to window requests in flight, window=1 being stop-and-wait;
+    replies come back in request order, so each one is matched against the
+    oldest outstanding request. nothing new is sent once a reply carries EOF.
+    a request's latency runs from the send that carried it to its reply
+
+    returns (download time, [(offset, reply), ...]): the wall clock from the
+    first request sent to the last reply received, the same definition for
+    every window. replies are printed by the caller afterwards, so output is
+    not counted; reply is None if the server closed the connection
+    """
+    reader = FrameReader(s) if binary else LineReader(s)
+    in_flight = deque()  # (request id, offset, send time) in send order
+    replies = []
+    request_id = 0
+    start = time.time()
+    while True:
+        # top the window up with a single send
+        batch = []
+        send_time = time.time()
+        while len(in_flight) < window:
+            in_flight.append((request_id, p, send_time))
+            batch.append(REQUEST.pack(request_id, p, k) if binary else f"{p},{k}\n".encode())
+            request_id += 1
+            p += k
+        if batch:
+            s.sendall(b"".join(batch))
+
+        expected_id, offset, send_time = in_flight.popleft()
+        if binary:
+            frame = reader.read_frame()
+            if frame is None:
+                replies.append((offset, None))
+                break
+            reply_id, flags, payload = frame
+            if reply_id != expected_id:
+                raise RuntimeError(f"reply {reply_id} arrived while waiting for {expected_id}")
+            reply = payload.decode()
+            eof = flags & FLAG_EOF
+        else:
+            line = reader.read_line()
+            if line is None:
+                replies.append((offset, None))
+                break
+            reply = line.decode()
+            eof = "EOF" in reply.split(",")
+        hist.record(time.time() - send_time)
+        replies.append((offset, reply))
+        if eof:
+            break
+    return time.time() - start, replies
+
+
+def main(config, binary=False, window=1):
     host = config["server_ip"]
     k = config["k"]
     p = config["p"]
@@ -14,23 +71,28 @@ def main(config):
         s.connect((host, port))
         print("[client] Connected to server.")
 
-        download_time = 0
-        while True:
-            message = f"{p},{k}\n"
-            send_time = time.time()
-            s.send(message.encode())
-            data = s.recv(1024)
-            recv_time = time.time()
-            download_time += recv_time - send_time
-            print("[client] Server replied:", data.decode())
-            decoded_data = data.decode()
-
-            if "EOF\n" in decoded_data.split(",") or "EOF" in decoded_data.split(","):
-                print(f"[client] Received EOF, exiting")
-                break
-            p += k
-        
-        print(f"ELAPSED_MS:{download_time*1000}")
+        if binary and not negotiate(s):
+            print("[client] Server does not speak the binary protocol, using text")
+            binary = False
+        hist = LatencyHistogram()
+        download_time, replies = download(s, p, k, window, binary, hist)
+
+    for offset, reply in replies:
+        if reply is None:
+            print("[client] Server closed the connection")
+        else:
+            print(f"[client] Server replied (p={offset}):", reply)
+    if replies and replies[-1][1] is not None:
+        print(f"[client] Received EOF, exiting")
+    report(download_time, hist)
+
+def report(download_time, hist):
+    """
+    ELAPSED_MS for run_experiments.py, then the per-request latencies
+    """
+    print(f"ELAPSED_MS:{download_time*1000}")
+    print(hist.summary())
+    print(hist.dumps())
 
 def read_json(filename) -> dict:
     with open(filename) as f:
@@ -39,8 +101,11 @@ def read_json(filename) -> dict:
     return data
 
 if __name__ == "__main__":
-    
-    filename = "config.json"
-    config = read_json(filename)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--binary", action="store_true", help="use the binary protocol (see wire.py)")
+    parser.add_argument("--window", type=int, default=None, help="requests kept in flight, defaults to config['window'] or 1 (stop-and-wait)")
+    args = parser.parse_args()
+    config = read_json(args.config)
 
-    main(config)
\ No newline at end of file
+    main(config, args.binary, args.window or config.get("window", 1))
\ No newline at end of file
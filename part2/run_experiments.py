@@ -1,19 +1,23 @@
 # STARTER CODE ONLY. EDIT AS DESIRED
 #!/usr/bin/env python3
 import re
-import time
 import csv
 from pathlib import Path
-from topo_wordcount import make_net
 import json
 import argparse
+from latency import LatencyHistogram, from_output, PERCENTILES
+from readiness import wait_ready, stop
+from sweep import run_sweep, max_parallel, write_slot_config, slot_host
+from backend import BACKENDS, LoopbackNet
 
 # Config
 K_VALUE = 20
 RUNS_PER_K = 5
-SERVER_CMD = "python3 server.py --config config.json"
+SERVER_CMD = "python3 server.py --config {config}"
 
 RESULTS_CSV = Path("results.csv")
+# request latency percentiles (us) of all clients, per run and merged per nc
+LATENCY_CSV = Path("latency.csv")
 
 def modify_config(
         key:str, 
@@ -48,8 +52,83 @@ def elaspsed_ms(out):
         return -1
     return int(m.group(1))
 
-def main(single_run: bool = False):
+def elapsed_ms_all(out):
+    """
+    one ELAPSED_MS per logical client of a loadgen.py run
+    """
+    values = [float(v) for v in re.findall(r"ELAPSED_MS:([\d.]+)", out)]
+    if not values:
+        print(f"[warn] No ELAPSED_MS found. Raw:\n{out}")
+        return [-1]
+    return values
+
+def write_latency(nc, r, hist):
+    percentiles = hist.percentiles()
+    with LATENCY_CSV.open("a", newline="") as f:
+        csv.writer(f).writerow([nc, r, hist.total] + list(percentiles.values()))
+
+def run_point(point, slot, net, loadgen, data, scratch=False):
+    """
+    one (nc, run) point on the hosts of slot; returns (avg_ms, latency histogram)
+    or None when the server did not come up. every process started here is
+    stopped before returning, so the slot is clean for the next point; they are
+    started without a shell so stop() reaches the process itself
+    """
+    nc, r, port = point
+    h0 = net.get(slot_host(slot, "h0"))
+    # num_clients is left alone: the sweep reads it back from config.json
+    overrides = {
+        # pick a new port to avoid TIME_WAIT issue
+        "server_port": port,
+        "server_ip": h0.IP(),
+    }
+    if "window" in data:
+        overrides["window"] = data["window"]
+    config = write_slot_config(slot, overrides, scratch) / "config.json"
+    print(f"[info] Running experiment: n_clients={nc}, run={r}, slot={slot}")
+    procs = []
+    try:
+        srv = h0.popen(SERVER_CMD.format(config=config))
+        procs.append(srv)
+        if not wait_ready(srv):
+            print(f"[warn] Server did not start for n_clients={nc}, run={r}")
+            return None
+
+        if loadgen:
+            # all nc clients are coroutines on h1, timed like client.py (first request to last reply)
+            h1 = net.get(slot_host(slot, "h1"))
+            procs.append(h1.popen(f"python3 loadgen.py --config {config} --clients {nc} --batch-size {data.get('window', 1)} --name h --words 0 --log-dir= --timing download --source {h1.IP()}"))
+        else:
+            clients = [net.get(slot_host(slot, f"h{i}")) for i in range(1, nc+1)]
+            procs.extend(h.popen(f"python3 client.py --config {config}") for h in clients)
+        # print(f"[server] {srv.communicate()[0].decode()}")
+        outs = [p.communicate()[0].decode() for p in procs[1:]]
+
+        # Don’t call communicate() on srv, wait_ready() drains its stdout
+        stop(srv)
+
+        if loadgen:
+            elaspsed_mss_list = elapsed_ms_all(outs[0])
+        else:
+            elaspsed_mss_list = [elaspsed_ms(out) for out in outs]
+        avg_ms = sum(elaspsed_mss_list) / len(elaspsed_mss_list)                
+
+        hist = LatencyHistogram()
+        for out in outs:
+            hist.merge(from_output(out))
+        print(f"[info] n_clients={nc}, run={r}, avg={avg_ms}, {hist.summary()}")
+        return avg_ms, hist
+    finally:
+        for proc in procs:
+            try:
+                stop(proc)
+            except Exception:
+                pass
+
+def main(single_run: bool = False, loadgen: bool = False, parallel: int = 1, backend: str = "mininet", window: int = None):
     data = read_json()
+    if window is not None:
+        data["window"] = window
     RUNS_PER_K = data["num_iterations"]
     NUM_CLIENTS = data["num_clients"]
     NUM_CLIENTS_LIST = list(range(1, NUM_CLIENTS+1, 4)) if not single_run else []
@@ -58,59 +137,56 @@ def main(single_run: bool = False):
     with RESULTS_CSV.open("w", newline="") as f:
         w = csv.writer(f)
         w.writerow(["nc", "r", "elapsed_ms"])
+    with LATENCY_CSV.open("w", newline="") as f:
+        csv.writer(f).writerow(["nc", "r", "requests"] + [f"p{q:g}" for q in PERCENTILES] + ["max"])
 
     if not Path("words.txt").exists():
         Path("words.txt").write_text("cat,bat,cat,dog,dog,emu,emu,emu,ant\n")
 
-    for nc in NUM_CLIENTS_LIST:
-        for r in range(1, RUNS_PER_K + 1):
-            print(f"[info] Running experiment: n_clients={nc}, run={r}")
-            srv = None
-            net = None
-            try:
-                # pick a new port to avoid TIME_WAIT issue
-                modify_config("num_clients", nc)
-                modify_config("server_port", 9000 + r + nc)  
-
-                net = make_net(nc)
-                net.start()
-
-                h_server = net.get("h0")
-                srv = h_server.popen(SERVER_CMD, shell=True)
-                time.sleep(0.5)
-
-                clients = [net.get(f"h{i}") for i in range(1, nc+1)]
-                procs = [h.popen("python3 client.py") for h in clients]
-                # print(f"[server] {srv.communicate()[0].decode()}")
-                outs = [p.communicate()[0].decode() for p in procs]
-
-                # Don’t call communicate() on srv (no real pipes)
-                srv.terminate()
-                time.sleep(0.2)
-
-                elaspsed_mss_list = [elaspsed_ms(out) for out in outs]
-                avg_ms = sum(elaspsed_mss_list) / len(elaspsed_mss_list)                
-
-                with RESULTS_CSV.open("a", newline="") as f:
-                    csv.writer(f).writerow([nc, r, avg_ms])
-
-                if single_run:
-                    print("Single run, exiting")
-                    return
-                print(f"[info] n_clients={nc}, run={r}, avg={avg_ms}")
-            finally:
-                if srv is not None:
-                    try:
-                        srv.terminate()
-                    except Exception:
-                        pass
-                if net is not None:
-                    net.stop()
-
+    # (nc, run, server port) for every point, each with its own port
+    runs = [(nc, r) for nc in NUM_CLIENTS_LIST for r in range(1, RUNS_PER_K + 1)]
+    if single_run:
+        runs = runs[:1]
+    points = [(nc, r, 9000 + i) for i, (nc, r) in enumerate(runs, start=1)]
+    slots = max_parallel(parallel, len(points))
+
+    # one network for the whole sweep, sized for the largest point and with a
+    # copy of the hosts per slot; a point with nc clients uses h1..h{nc} of its slot
+    if backend == "loopback":
+        net = LoopbackNet()
+    else:
+        from topo_wordcount import make_net
+        net = make_net(1 if loadgen else max(NUM_CLIENTS_LIST), slots)
+    net.start()
+    # configs go to copies under slots/ unless this is a plain mininet run;
+    # a --window run leaves the window in config.json as it is
+    scratch = backend == "loopback" or window is not None
+    try:
+        results = run_sweep(points, lambda point, slot: run_point(point, slot, net, loadgen, data, scratch), slots)
+    finally:
+        net.stop()
+
+    # one dataset, in sweep order whichever slot ran each point
+    merged = {}  # nc -> latencies of every client over all runs
+    for (nc, r, _), result in zip(points, results):
+        if result is None:
+            continue
+        avg_ms, hist = result
+        with RESULTS_CSV.open("a", newline="") as f:
+            csv.writer(f).writerow([nc, r, avg_ms])
+        merged.setdefault(nc, LatencyHistogram()).merge(hist)
+        write_latency(nc, r, hist)
+    if not single_run:
+        for nc, hist in merged.items():
+            write_latency(nc, "all", hist)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--single_run", action="store_true", help="Run only one experiment and exit")
+    parser.add_argument("--loadgen", action="store_true", help="simulate the clients with loadgen.py on one host")
+    parser.add_argument("--parallel", type=int, default=1, help="sweep points run at once, each on its own slot of hosts (sweep.py)")
+    parser.add_argument("--window", type=int, default=None, help="requests each client keeps in flight, overrides config['window'] for this run")
+    parser.add_argument("--backend", choices=BACKENDS, default="mininet", help="loopback runs the hosts as local processes on 127.0.0.x, without root (backend.py)")
     args = parser.parse_args()
     single_run = args.single_run
-    main(single_run)
\ No newline at end of file
+    main(single_run, args.loadgen, args.parallel, args.backend, args.window)
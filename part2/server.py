@@ -1,6 +1,16 @@
 import select
+import selectors
 import socket
 import json
+import argparse
+import signal
+import sys
+from collections import deque
+from itertools import islice
+import aio_server
+from corpus import Corpus, load_corpus, IOV_MAX
+from wire import RequestParser, reply
+from workers import STATS, CONNECTIONS, REQUESTS, supervise
 
 def clear_connection(sock, sockets_list, clients):
     sockets_list.remove(sock)
@@ -9,75 +19,225 @@ def clear_connection(sock, sockets_list, clients):
     sock.close()
     return
 
-def handle_request(message: str, words: list[str]) -> str:
-    try:
-        parts = message.strip().split(",")
-        p = int(parts[0])
-        k = int(parts[1])
-    except (ValueError, IndexError):
-        return "ERROR: Invalid request\n"
-
-    # print(f"{p},{k}")
-    if p >= len(words):
-        return "EOF\n"
-    elif p + k > len(words):
-        return ",".join(words[p:]) + ",EOF\n"
-    else:
-        return ",".join(words[p:p+k]) + "\n"
+def handle_request(request: tuple, corpus: Corpus) -> list:
+    """
+    buffers answering one parsed request (text "p,k" or binary frame), slices
+    of the corpus so nothing is copied
+    """
+    return reply(corpus, request, [b"ERROR: Invalid request\n"])
 
 
-def main(config):
-    host = config["server_ip"]
-    port = config["server_port"]
-    words_file = config["filename"]
-    print(f"[server] Starting server on {host}:{port}, words_file={words_file}", flush=True)
-    with open(words_file) as f:
-        words = f.read().split(",")
-        words = [w.split("\n")[0] for w in words]
+# stop reading from a client once this many reply bytes are waiting to be sent
+HIGH_WATER = 256 * 1024
 
-    # Create listening socket same as C
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
-    server_socket.listen()
+class Connection:
+    """
+    state kept for every connected client: the address, the parser holding any
+    partial request and the replies the non-blocking socket has not accepted yet
+    """
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.parser = RequestParser()
+        self.outq = deque()
+        self.out_bytes = 0
+
+    def serve(self, data: bytes, corpus: Corpus) -> None:
+        """
+        answers all requests completed by data with a single batched write
+        """
+        requests = self.parser.feed(data)
+        for request in requests:
+            for buf in handle_request(request, corpus):
+                self.outq.append(memoryview(buf))
+                self.out_bytes += len(buf)
+        STATS.counts[REQUESTS] += len(requests)
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        writes queued replies with sendmsg until the queue is empty or the
+        socket would block, the rest waits for the next writable event
+        """
+        while self.outq:
+            try:
+                sent = self.sock.sendmsg(list(islice(self.outq, IOV_MAX)))
+            except BlockingIOError:
+                return
+            self.out_bytes -= sent
+            # empty buffers (a reply with no words) are dropped here as well,
+            # otherwise a queue holding only those would be retried forever
+            while self.outq and sent >= len(self.outq[0]):
+                sent -= len(self.outq.popleft())
+            if sent:
+                self.outq[0] = self.outq[0][sent:]
 
+    def wants_read(self) -> bool:
+        return self.out_bytes < HIGH_WATER
+
+    def events(self) -> int:
+        """
+        selector interest: read unless paused by HIGH_WATER, write only while
+        replies are queued
+        """
+        events = selectors.EVENT_READ if self.wants_read() else 0
+        if self.outq:
+            events |= selectors.EVENT_WRITE
+        return events
+
+
+def serve_select(server_socket, corpus):
     # list sockets to work on
     sockets_list = [server_socket]
 
     clients = {}
 
     while True:
-        read_sockets, _, exception_sockets = select.select(sockets_list, [], sockets_list)
+        readers = [sock for sock in sockets_list if sock is server_socket or clients[sock].wants_read()]
+        writers = [sock for sock in sockets_list if sock in clients and clients[sock].outq]
+        read_sockets, write_sockets, exception_sockets = select.select(readers, writers, sockets_list)
         # iterate over notified sockets
         for read_socket in read_sockets:
             
             if read_socket is server_socket:
                 # New connection
                 client_socket, client_address = server_socket.accept()
+                client_socket.setblocking(False)
                 sockets_list.append(client_socket)
-                clients[client_socket] = client_address
+                clients[client_socket] = Connection(client_socket, client_address)
+                STATS.counts[CONNECTIONS] += 1
                 print(f"[server] Accepted connection from {client_address}")
             else:
                 # Existing client sent data
                 try:
-                    recv_data = read_socket.recv(1024)
+                    recv_data = read_socket.recv(65536)
                     if recv_data:
-                        message = recv_data.decode()
-                        
-                        send_message = handle_request(message, words)
-                        read_socket.sendall(send_message.encode())
+                        clients[read_socket].serve(recv_data, corpus)
                     else:
                         # Client disconnected
-                        print(f"[server] Closed connection from {clients[read_socket]}")
+                        print(f"[server] Closed connection from {clients[read_socket].address}")
                         clear_connection(read_socket, sockets_list, clients)
                 
-                except ConnectionResetError:
-                    print(f"[server] Connection reset by {clients[read_socket]}")
+                except BlockingIOError:
+                    pass
+                except (ConnectionResetError, BrokenPipeError):
+                    print(f"[server] Connection reset by {clients[read_socket].address}")
                     clear_connection(read_socket, sockets_list, clients)
 
+        # Send queued replies to clients that can take more
+        for write_socket in write_sockets:
+            if write_socket not in clients:
+                continue
+            try:
+                clients[write_socket].flush()
+            except (ConnectionResetError, BrokenPipeError):
+                print(f"[server] Connection reset by {clients[write_socket].address}")
+                clear_connection(write_socket, sockets_list, clients)
+
         # Handle exceptions
         for read_socket in exception_sockets:
-            clear_connection(read_socket, sockets_list, clients)
+            if read_socket in clients:
+                clear_connection(read_socket, sockets_list, clients)
+
+
+def close_connection(sel, conn):
+    sel.unregister(conn.sock)
+    conn.sock.close()
+    return
+
+def serve_epoll(server_socket, corpus):
+    """
+    same request handling as serve_select, but the sockets stay registered with
+    the kernel (epoll on linux) so a wakeup only costs the number of ready sockets
+    """
+    sel = selectors.DefaultSelector()
+    server_socket.setblocking(False)
+    sel.register(server_socket, selectors.EVENT_READ, None)
+
+    while True:
+        for key, mask in sel.select():
+            if key.data is None:
+                # drain the accept backlog in one go
+                while True:
+                    try:
+                        client_socket, client_address = server_socket.accept()
+                    except BlockingIOError:
+                        break
+                    client_socket.setblocking(False)
+                    sel.register(client_socket, selectors.EVENT_READ, Connection(client_socket, client_address))
+                    STATS.counts[CONNECTIONS] += 1
+                    print(f"[server] Accepted connection from {client_address}")
+                continue
+
+            conn = key.data
+            try:
+                if mask & selectors.EVENT_WRITE:
+                    conn.flush()
+                if mask & selectors.EVENT_READ:
+                    recv_data = conn.sock.recv(65536)
+                    if not recv_data:
+                        print(f"[server] Closed connection from {conn.address}")
+                        close_connection(sel, conn)
+                        continue
+                    conn.serve(recv_data, corpus)
+                if conn.events() != key.events:
+                    sel.modify(conn.sock, conn.events(), conn)
+            except BlockingIOError:
+                pass
+            except (ConnectionResetError, BrokenPipeError):
+                print(f"[server] Connection reset by {conn.address}")
+                close_connection(sel, conn)
+
+
+def serve_asyncio(server_socket, corpus):
+    """
+    asyncio Protocol per client, requests answered as soon as they are framed
+    """
+    host, port = server_socket.getsockname()
+    def respond(request):
+        STATS.counts[REQUESTS] += 1
+        return handle_request(request, corpus)
+    aio_server.run(respond, host, port, "direct", name="[server]", sock=server_socket)
+
+
+ENGINES = {"select": serve_select, "epoll": serve_epoll, "asyncio": serve_asyncio}
+
+def listen_socket(host, port, reuse_port=False):
+    # Create listening socket same as C
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # every worker binds the same port, the kernel balances connections
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(socket.SOMAXCONN)
+    return server_socket
+
+
+def main(config, engine="select", workers=1):
+    host = config["server_ip"]
+    port = config["server_port"]
+    words_file = config["filename"]
+    print(f"[server] Starting server on {host}:{port}, words_file={words_file}, engine={engine}, workers={workers}", flush=True)
+    # part2 only attaches EOF once a request runs past the last word
+    corpus = load_corpus(words_file, config.get("corpus", "memory"), eof_on_last=False, cache_bytes=config.get("cache_bytes", 0))
+    print(f"[server] Loaded {corpus.describe()}", flush=True)
+
+    def run(reuse_port=False):
+        try:
+            server_socket = listen_socket(host, port, reuse_port)
+            # the runners wait for this line instead of sleeping (readiness.py)
+            print(f"[server] Listening on {host}:{port}", flush=True)
+            ENGINES[engine](server_socket, corpus)
+        finally:
+            if corpus.cache is not None:
+                print(f"[server] {corpus.cache.summary()}", flush=True)
+
+    if workers > 1:
+        # corpus is loaded before forking so the workers share its pages
+        supervise(lambda i: run(reuse_port=True), workers, config.get("stats_interval", 5.0))
+    else:
+        run()
 
 
 def read_json(filename) -> dict:
@@ -87,6 +247,16 @@ def read_json(filename) -> dict:
     return data
 
 if __name__ == "__main__":
-    config = read_json("config.json")
-    
-    main(config)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--corpus", choices=["memory", "mmap"], default=None, help="how words_file is loaded, defaults to config['corpus'] or memory")
+    parser.add_argument("--workers", type=int, default=None, help="processes sharing server_port via SO_REUSEPORT, defaults to config['workers'] or 1")
+    parser.add_argument("--engine", choices=ENGINES.keys(), default=None, help="event loop, defaults to config['engine'] or select")
+    args = parser.parse_args()
+    config = read_json(args.config)
+    if args.corpus:
+        config["corpus"] = args.corpus
+    # exit through the finally blocks (cache summary) on terminate()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    main(config, args.engine or config.get("engine", "select"), args.workers or config.get("workers", 1))
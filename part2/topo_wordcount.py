@@ -4,20 +4,27 @@ from mininet.net import Mininet
 from mininet.node import OVSController
 from mininet.link import TCLink
 import json
+from sweep import slot_host, slot_ip
 
 class WordCountTopo(Topo):
-    def build(self, n):
-        s1 = self.addSwitch('s1')
+    def build(self, n, slots=1):
+        """
+        h0 is the server and h1..hn the clients; slots past the first
+        (parallel sweeps, see sweep.py) get their own copies, slot<s>h<i>
+        """
         with open("config.json") as f:
             data = json.load(f)
         ip = data["server_ip"]
-        host = self.addHost(f"h{0}", ip=ip)
-        self.addLink(host, s1, cls=TCLink, bw=100)
-        for i in range(1, n+1):
+        # one switch per slot so parallel points do not share a link
+        for slot in range(slots):
+            switch = self.addSwitch(f"s{slot+1}")
+            host = self.addHost(slot_host(slot, "h0"), ip=slot_ip(slot, ip))
+            self.addLink(host, switch, cls=TCLink, bw=100)
+            for i in range(1, n+1):
 
-            host = self.addHost(f"h{i}", ip=f"10.0.0.{i+1}/24")
-            self.addLink(host, s1, cls=TCLink, bw=100)
+                host = self.addHost(slot_host(slot, f"h{i}"), ip=f"10.0.{slot}.{i+1}/24")
+                self.addLink(host, switch, cls=TCLink, bw=100)
 
-def make_net(n):
-    return Mininet(topo=WordCountTopo(n), controller=OVSController,
+def make_net(n, slots=1):
+    return Mininet(topo=WordCountTopo(n, slots), controller=OVSController,
                    autoSetMacs=True, autoStaticArp=True, listenPort=5222)
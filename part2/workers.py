@@ -0,0 +1,125 @@
+"""
+multi-process mode for the part2 server (--workers N)
+
+the parent forks N workers after loading the corpus; each worker binds
+server_port with SO_REUSEPORT and runs its own event loop, so the kernel spreads
+new connections across them. the parent restarts workers that die and prints the
+counters summed over all workers, which live in a shared anonymous mapping
+"""
+import ctypes
+import mmap
+import os
+import signal
+import time
+import traceback
+
+FIELDS = ("connections", "requests")
+CONNECTIONS, REQUESTS = range(len(FIELDS))
+
+# a worker that dies sooner than this after starting is restarted after a pause
+MIN_UPTIME = 1.0
+
+# from <linux/prctl.h>
+PR_SET_PDEATHSIG = 1
+
+
+class Stats:
+    """
+    per-process counters, indexed by CONNECTIONS / REQUESTS; under --workers the
+    list is swapped for this worker's slot of the shared mapping
+    """
+    def __init__(self):
+        self.counts = [0] * len(FIELDS)
+
+
+STATS = Stats()
+
+
+def format_counts(counts) -> str:
+    return " ".join(f"{name}={counts[i]}" for i, name in enumerate(FIELDS))
+
+
+def die_with_parent(parent: int) -> None:
+    """
+    has the kernel SIGTERM this worker when the supervisor dies, SIGKILL
+    included, so no orphan keeps serving the SO_REUSEPORT port
+    """
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass  # not linux: only the check below
+    # the supervisor may have died before prctl took effect
+    if os.getppid() != parent:
+        raise SystemExit(0)
+
+
+def supervise(run_worker, n_workers: int, interval: float = 5.0) -> None:
+    """
+    runs run_worker(i) in n_workers forked processes until SIGTERM/SIGINT
+    """
+    width = len(FIELDS)
+    shared = mmap.mmap(-1, n_workers * width * 8)
+    slots = memoryview(shared).cast("Q")
+    workers = {}  # pid -> (worker index, start time)
+
+    parent = os.getpid()
+
+    def spawn(i):
+        pid = os.fork()
+        if pid == 0:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, [signal.SIGCHLD])
+            code = 0
+            try:
+                die_with_parent(parent)
+                STATS.counts = slots[i * width:(i + 1) * width]
+                run_worker(i)
+            except (KeyboardInterrupt, SystemExit):
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = (i, time.monotonic())
+
+    def totals():
+        return [sum(slots[i * width + f] for i in range(n_workers)) for f in range(width)]
+
+    def shutdown(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    # SIGCHLD is consumed with sigtimedwait instead of a handler
+    signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+    for i in range(n_workers):
+        spawn(i)
+    print(f"[server] Started {n_workers} workers: {sorted(workers)}", flush=True)
+
+    last = None
+    try:
+        while True:
+            signal.sigtimedwait([signal.SIGCHLD], interval)
+            while workers:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                i, started = workers.pop(pid)
+                print(f"[server] Worker {i} (pid {pid}) exited with {os.waitstatus_to_exitcode(status)}, restarting", flush=True)
+                if time.monotonic() - started < MIN_UPTIME:
+                    time.sleep(MIN_UPTIME)
+                spawn(i)
+            current = totals()
+            if current != last:
+                print(f"[server] workers={n_workers} {format_counts(current)}", flush=True)
+                last = current
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            os.waitpid(pid, 0)
+        print(f"[server] Stopped {n_workers} workers, {format_counts(totals())}", flush=True)
@@ -4,10 +4,12 @@ import time
 import sys
 import argparse
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
+from latency import LatencyHistogram
+from wire import LineReader
 
 class WordCountClient:
-    def __init__(self, config_file='config.json', client_id=1, is_greedy=False, greedy_requests=1):
+    def __init__(self, config_file='config.json', client_id=1, is_greedy=False, greedy_requests=1, count_mode=False):
         with open(config_file, 'r') as f:
             self.config = json.load(f)
         self.server_ip = self.config.get('server_ip', '10.0.0.100')
@@ -16,52 +18,84 @@ class WordCountClient:
         self.client_id = client_id
         self.is_greedy = is_greedy
         self.window_size = greedy_requests 
+        # ask for "COUNT p,k" histograms instead of the words themselves
+        self.count_mode = count_mode
         self.word_count = defaultdict(int)
+        # one latency per reply, measured from the send of its request
+        self.latency = LatencyHistogram()
+        self.sent_at = deque()
         self.start_time = None
         self.end_time = None
 
+    def add_counts(self, response):
+        """
+        adds a "word:count,..." reply to word_count, returns how many words it covered
+        """
+        covered = 0
+        for item in response.split(','):
+            if item and item != 'EOF':
+                word, count = item.rsplit(':', 1)
+                self.word_count[word] += int(count)
+                covered += int(count)
+        return covered
+
     def download_file(self):
         self.start_time = time.time()
         all_words = []
+        words_counted = 0
         words_to_get = 200 
+        prefix = "COUNT " if self.count_mode else ""
 
         try:
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.connect((self.server_ip, self.server_port))
 
             requests_sent = 0
+            # offsets of the requests in flight, oldest first, to resend one refused BUSY
+            offsets = deque()
             
            
             for i in range(self.window_size):
-                request = f"{requests_sent * self.k},{self.k}\n"
+                request = f"{prefix}{requests_sent * self.k},{self.k}\n"
                 client_socket.sendall(request.encode('utf-8'))
+                self.sent_at.append(time.time())
+                offsets.append(requests_sent * self.k)
                 requests_sent += 1
             
-            response_buffer = ""
-            while len(all_words) < words_to_get:
-                
-                while '\n' not in response_buffer:
-                    data = client_socket.recv(1024).decode('utf-8')
-                    if not data: 
-                        break
-                    response_buffer += data
+            reader = LineReader(client_socket)
+            while len(all_words) + words_counted < words_to_get:
                 
-                if not response_buffer:
+                line = reader.read_line()
+                if line is None:
                     break
 
-                response, response_buffer = response_buffer.split('\n', 1)
+                self.latency.record(time.time() - self.sent_at.popleft())
+                offset = offsets.popleft()
+                if line == b"BUSY":
+                    # the server's queue was full, ask again
+                    client_socket.sendall(f"{prefix}{offset},{self.k}\n".encode('utf-8'))
+                    self.sent_at.append(time.time())
+                    offsets.append(offset)
+                    continue
+                response = line.decode('utf-8')
                 print(response)
-                if "EOF" in response:
+                if self.count_mode:
+                    words_counted += self.add_counts(response)
+                    if "EOF" in response:
+                        break
+                elif "EOF" in response:
                     words = [w for w in response.split(',') if w and w != 'EOF']
                     all_words.extend(words)
                     break 
-                
-                words = [w for w in response.split(',') if w]
-                all_words.extend(words)
+                else:
+                    words = [w for w in response.split(',') if w]
+                    all_words.extend(words)
 
                 if requests_sent * self.k < words_to_get:
-                    request = f"{requests_sent * self.k},{self.k}\n"
+                    request = f"{prefix}{requests_sent * self.k},{self.k}\n"
                     client_socket.sendall(request.encode('utf-8'))
+                    self.sent_at.append(time.time())
+                    offsets.append(requests_sent * self.k)
                     requests_sent += 1
 
             client_socket.close()
@@ -86,16 +120,20 @@ class WordCountClient:
                 os.makedirs(log_dir)
             with open(f"{log_dir}/{self.client_id}.log", "w") as f:
                 f.write(str(completion_time))
+            with open(f"{log_dir}/{self.client_id}.hist", "w") as f:
+                f.write(f"{self.latency.dumps()}\n{self.latency.summary()}\n")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Word Count Client")
     parser.add_argument('--client-id', type=str, default='client1')
     parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--count', action='store_true', help='request per-range word counts (COUNT p,k) instead of words')
     args = parser.parse_args()
     client = WordCountClient(
         client_id=args.client_id,
         is_greedy=True, 
-        greedy_requests=args.batch_size 
+        greedy_requests=args.batch_size,
+        count_mode=args.count
     )
     if client.download_file():
         client.log_results()
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""
+words file kept as one immutable bytes buffer plus the start offset of every word
+
+the words in the file are already comma separated, so the response for (p, k) is
+just the slice from the start of word p to the end of word p+k-1; it is sent as a
+memoryview together with the "\\n" / ",EOF\\n" tail without joining or encoding
+
+MappedCorpus does the same over an mmap of the file for corpora too large to
+read up front. a ResponseCache can be attached to keep recent replies as single
+encoded buffers.
+
+COUNT requests are answered from a per-word index of sorted positions: the
+frequency of a word in [p, p+k) is two bisects, so a whole histogram costs
+O(vocab * log n) without touching the words in the range
+"""
+import mmap
+import os
+import threading
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from array import array
+from itertools import accumulate
+
+NEWLINE = b"\n"
+EOF_TAIL = b",EOF\n"
+EOF_ONLY = b"EOF\n"
+
+# sendmsg accepts at most IOV_MAX buffers per call
+IOV_MAX = 1024
+
+
+class Corpus:
+    # COUNT over fewer words than this is answered without building the index
+    DIRECT_COUNT = 4096
+
+    def __init__(self, data: bytes, eof_on_last=True):
+        """
+        eof_on_last: attach EOF to a response that ends exactly on the last word,
+        otherwise EOF is only attached when the request runs past the end
+        """
+        self.data = data.strip()
+        self.view = memoryview(self.data)
+        self.eof_on_last = eof_on_last
+        self.offsets = self.build_offsets(self.data)
+        self.cache = None
+        self.positions = None
+        # held while building an index on first use, requests come from several threads
+        self.index_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, filename, eof_on_last=True):
+        with open(filename, "rb") as f:
+            return cls(f.read(), eof_on_last)
+
+    @staticmethod
+    def build_offsets(data: bytes) -> array:
+        """
+        start offset of every word, plus a sentinel one past the end of the last
+        word so word i always spans offsets[i] .. offsets[i+1]-1
+        """
+        if not data:
+            return array("Q", [0])
+        # word i+1 starts one past the comma ending word i
+        return array("Q", accumulate(map((1).__add__, map(len, data.split(b","))), initial=0))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def describe(self) -> str:
+        return f"{len(self)} words"
+
+    def words_past(self, i: int) -> int:
+        """
+        number of words in the corpus, or any count greater than i; lets the
+        mapped corpus answer without indexing past the request
+        """
+        return len(self)
+
+    def word(self, i) -> bytes:
+        return self.data[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def attach_cache(self, cache) -> None:
+        """
+        serve replies through cache; entries built from a previous corpus are
+        dropped, and so are the ones its requests still in flight try to put
+        """
+        cache.clear(owner=self)
+        self.cache = cache
+
+    def response(self, p: int, k: int) -> list:
+        """
+        buffers making up the reply to "p,k", raises ValueError for negative p or k
+        """
+        if self.cache is None:
+            return self.build_response(p, k)
+        cached = self.cache.get((p, k))
+        if cached is None:
+            cached = b"".join(self.build_response(p, k))
+            self.cache.put((p, k), cached, owner=self)
+        return [cached]
+
+    def build_response(self, p: int, k: int) -> list:
+        body, eof = self.slice(p, k)
+        if not body:
+            return [EOF_ONLY if eof else NEWLINE]
+        return [body, EOF_TAIL if eof else NEWLINE]
+
+    def slice(self, p: int, k: int):
+        """
+        (words p..p+k-1 comma separated, whether the reply carries EOF)
+        """
+        if p < 0 or k < 0:
+            raise ValueError(f"invalid request {p},{k}")
+        n = self.words_past(p + k)
+        if p >= n:
+            return self.view[0:0], True
+        end = min(p + k, n)
+        if end == p:
+            return self.view[0:0], False
+        eof = end >= n if self.eof_on_last else p + k > n
+        return self.view[self.offsets[p]:self.offsets[end] - 1], eof
+
+    def words(self):
+        return iter(self.data.split(b",")) if self.data else iter(())
+
+    def word_positions(self) -> dict:
+        """
+        word -> array of its positions in increasing order, built on first use
+        """
+        with self.index_lock:
+            if self.positions is None:
+                positions = defaultdict(lambda: array("Q"))
+                for i, word in enumerate(self.words()):
+                    positions[word].append(i)
+                self.positions = dict(positions)
+        return self.positions
+
+    def counts(self, p: int, k: int):
+        """
+        ([(word, count), ...] sorted by word, eof) for words p..p+k-1
+        """
+        body, eof = self.slice(p, k)
+        if not body:
+            return [], eof
+        span = min(p + k, self.words_past(p + k)) - p
+        # short ranges are cheaper to count directly than to bisect every word
+        limit = self.DIRECT_COUNT if self.positions is None else len(self.positions)
+        if span <= limit:
+            return sorted(Counter(body.tobytes().split(b",")).items()), eof
+        tally = []
+        for word, where in self.word_positions().items():
+            count = bisect_left(where, p + span) - bisect_left(where, p)
+            if count:
+                tally.append((word, count))
+        return sorted(tally), eof
+
+    def count_response(self, p: int, k: int) -> list:
+        """
+        reply to "COUNT p,k": "word:count,..." with the same newline/EOF rules
+        as a word reply
+        """
+        tally, eof = self.counts(p, k)
+        if not tally:
+            return [EOF_ONLY if eof else NEWLINE]
+        body = b",".join(word + b":" + str(count).encode() for word, count in tally)
+        return [body, EOF_TAIL if eof else NEWLINE]
+
+
+class MappedCorpus(Corpus):
+    """
+    corpus backed by an mmap of the words file; nothing is read at startup and
+    the offset index is extended only as far as the largest word requested so far
+    """
+    WHITESPACE = b" \t\r\n"
+
+    def __init__(self, filename, eof_on_last=True):
+        self.eof_on_last = eof_on_last
+        self.cache = None
+        self.positions = None
+        # a reentrant lock: word_positions() scans the file while holding it
+        self.index_lock = threading.RLock()
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.data)
+        # same bounds as bytes.strip()
+        start, stop = 0, len(self.data)
+        while start < stop and self.data[start] in self.WHITESPACE:
+            start += 1
+        while stop > start and self.data[stop - 1] in self.WHITESPACE:
+            stop -= 1
+        self.stop = stop
+        self.offsets = array("Q", [start])
+        # set once the sentinel past the last word has been appended
+        self.complete = start == stop
+        if self.complete:
+            self.offsets[0] = 0
+
+    def scan(self, count: int) -> None:
+        """
+        extends the index until it holds count word starts or reaches the end;
+        only one thread extends it at a time, the others wait and find it done
+        """
+        offsets = self.offsets
+        if self.complete or len(offsets) >= count:
+            return
+        with self.index_lock:
+            while not self.complete and len(offsets) < count:
+                comma = self.data.find(b",", offsets[-1], self.stop)
+                if comma < 0:
+                    offsets.append(self.stop + 1)
+                    self.complete = True
+                else:
+                    offsets.append(comma + 1)
+
+    def __len__(self):
+        self.scan(float("inf"))
+        return len(self.offsets) - 1
+
+    def describe(self) -> str:
+        return f"{len(self.data)} bytes (mmap, indexed on demand)"
+
+    def words_past(self, i: int) -> int:
+        self.scan(i + 1)
+        if self.complete:
+            return len(self.offsets) - 1
+        return len(self.offsets)
+
+    def word(self, i) -> bytes:
+        self.scan(i + 2)
+        return super().word(i)
+
+    def words(self):
+        for i in range(len(self)):
+            yield self.word(i)
+
+
+class ResponseCache:
+    """
+    LRU map (p, k) -> encoded reply, evicting the oldest entries once the replies
+    held exceed max_bytes; every client walks the same offsets with the same k,
+    so after the first client the replies come from here
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # the corpus the entries were built from, see Corpus.attach_cache
+        self.owner = None
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value: bytes, owner=None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if owner is not None and owner is not self.owner:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self, owner=None) -> None:
+        with self.lock:
+            self.owner = owner
+            self.entries.clear()
+            self.size = 0
+
+    def summary(self) -> str:
+        return (f"cache hits={self.hits} misses={self.misses} evictions={self.evictions} "
+                f"entries={len(self.entries)} bytes={self.size}/{self.max_bytes}")
+
+
+def load_corpus(filename, mode="memory", eof_on_last=True, cache_bytes=0) -> Corpus:
+    """
+    mode is "memory" (read the whole file, index eagerly) or "mmap";
+    cache_bytes > 0 attaches a ResponseCache of that budget
+    """
+    if mode == "mmap" and os.path.getsize(filename) > 0:
+        corpus = MappedCorpus(filename, eof_on_last)
+    else:
+        corpus = Corpus.load(filename, eof_on_last)
+    if cache_bytes > 0:
+        corpus.attach_cache(ResponseCache(cache_bytes))
+    return corpus
+
+
+def send_buffers(sock, buffers) -> int:
+    """
+    writes all buffers using scatter/gather, one sendmsg per IOV_MAX buffers
+    unless the kernel takes a partial write; returns the number of sendmsg calls
+    """
+    pending = [memoryview(b) for b in buffers]
+    i = 0
+    calls = 0
+    while i < len(pending):
+        sent = sock.sendmsg(pending[i:i + IOV_MAX])
+        calls += 1
+        # also steps over empty buffers, which sendmsg alone never consumes
+        while i < len(pending) and sent >= len(pending[i]):
+            sent -= len(pending[i])
+            i += 1
+        if sent:
+            pending[i] = pending[i][sent:]
+    return calls
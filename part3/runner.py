@@ -1,18 +1,17 @@
 #!/usr/bin/env python3
 import json
 import os
-import time
 import glob
-import numpy as np
-import subprocess
-import matplotlib.pyplot as plt
 import sys
 import argparse
-from mininet.cli import CLI
-from topology import create_network
+import threading
+from latency import LatencyHistogram, merge_files
+from readiness import wait_ready, stop
+from sweep import HERE, run_sweep, max_parallel, write_slot_config, slot_host
+from backend import BACKENDS, LoopbackNet
 
 class Runner:
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file='config.json', loadgen=False, parallel=1, backend='mininet'):
         with open(config_file, 'r') as f:
             self.config = json.load(f)
         
@@ -24,18 +23,50 @@ class Runner:
         self.p = self.config['p']  # Offset (always 0) since we want to download the full file
         self.k = self.config['k']  # Words per request (always 5)
         
+        # run the clients as coroutines of loadgen.py instead of one client.py each
+        self.loadgen = loadgen
+        # c -> request latencies of every client over all runs with that c
+        self.latency = {}
+        self.latency_lock = threading.Lock()
+        # experiments of a sweep run at the same time, each on its own slot of
+        # hosts (sweep.py); the network is built with self.slots of them
+        self.parallel = parallel
+        self.slots = 1
+        # mininet, or loopback for plain local processes (backend.py)
+        self.backend = backend
+        # with loadgen the rogue runs on client1 and every normal client on client2
+        self.num_hosts = min(self.num_clients, 2) if loadgen else self.num_clients
+        # built by the first experiment and reused by the rest of the sweep
+        self.net = None
+        
         print(f"Config: {self.num_clients} clients, c={self.c}, p={self.p}, k={self.k}")
 
-    def cleanup_logs(self):
-        if not os.path.exists('logs'):
-            os.makedirs('logs')
-        for log in glob.glob("logs/*.log"):
+    def start_network(self):
+        """
+        creates the network on first use, later experiments get the same one
+        """
+        if self.net is None and self.backend == 'loopback':
+            self.net = LoopbackNet()
+        elif self.net is None:
+            from topology import create_network
+            self.net = create_network(num_clients=self.num_hosts, slots=self.slots)
+        return self.net
+
+    def stop_network(self):
+        if self.net is not None:
+            self.net.stop()
+            self.net = None
+
+    def cleanup_logs(self, log_dir='logs'):
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        for log in glob.glob(f"{log_dir}/*.log") + glob.glob(f"{log_dir}/*.hist"):
             os.remove(log)
         print("Cleaned old logs")
 
-    def parse_logs(self):
+    def parse_logs(self, log_dir='logs'):
         completion_times = []
-        log_files = glob.glob("logs/*.log")
+        log_files = glob.glob(f"{log_dir}/*.log")
         if len(log_files) < self.num_clients:
             print(f"Warning: Expected {self.num_clients} log files, but found {len(log_files)}")
             return []
@@ -47,6 +78,16 @@ class Runner:
                 pass
         return completion_times
 
+    def parse_latency(self, c_value, log_dir='logs'):
+        """
+        merges the clients' logs/*.hist into the histogram kept for c_value
+        """
+        hist = merge_files(glob.glob(f"{log_dir}/*.hist"))
+        print(f"Request latency (c={c_value}): {hist.summary()}")
+        with self.latency_lock:
+            self.latency.setdefault(c_value, LatencyHistogram()).merge(hist)
+        return hist
+
     def calculate_jfi(self, values):
         if not values or len(values) < 2:
             return 1.0
@@ -63,37 +104,54 @@ class Runner:
 
 
 
-    def run_experiment(self, c_value):
-        """Run single experiment with given c value"""
-        print(f"Running experiment with c={c_value}")
+    def run_experiment(self, c_value, slot=0):
+        """Run single experiment with given c value on the hosts of slot"""
+        print(f"Running experiment with c={c_value}, slot={slot}")
         
+        net = self.start_network()
+        server = net.get(slot_host(slot, 'server', 'srv'))
+        clients = [net.get(slot_host(slot, f'client{i+1}', f'c{i+1}')) for i in range(self.num_hosts)]
+        # everything runs in the slot's directory, with its own config.json and logs/;
+        # the port is per slot too, in case the slots share a network namespace
+        cwd = write_slot_config(slot, {'server_ip': server.IP(), 'server_port': self.port + slot},
+                                scratch=self.backend == 'loopback')
+        log_dir = cwd / 'logs'
         # Clean logs
-        self.cleanup_logs()
+        self.cleanup_logs(log_dir)
         
-        # Create network
-        from topology import create_network
-        net = create_network(num_clients=self.num_clients)
+        # started without a shell, so stop() reaches the process itself
+        procs = []
         
         try:
-            # Get hosts
-            server = net.get('server')
-            clients = [net.get(f'client{i+1}') for i in range(self.num_clients)]
-            
             # Start server (students create server.py)
             print("Starting server...")
-            server_proc = server.popen("python3 server.py")
-            time.sleep(3)
+            server_proc = server.popen(f"python3 {HERE / 'server.py'}", cwd=cwd)
+            procs.append(server_proc)
+            # the server's queue gauges, printed at exit (and every stats_interval if set)
+            if not wait_ready(server_proc, keep=r"^QUEUE "):
+                print("Server did not start")
+                return []
             
             # Start clients
             print("Starting clients...")
-            # Client 1 is rogue (batch size c)
-            rogue_proc = clients[0].popen(f"python3 client.py --batch-size {c_value} --client-id rogue")
-            
-            # Clients 2-N are normal (batch size 1)
-            normal_procs = []
-            for i in range(1, self.num_clients):
-                proc = clients[i].popen(f"python3 client.py --batch-size 1 --client-id normal_{i+1}")
-                normal_procs.append(proc)
+            if self.loadgen:
+                rogue_proc = clients[0].popen(
+                    f"python3 {HERE / 'loadgen.py'} --clients 1 --batch-size {c_value} --name rogue --source {clients[0].IP()}", cwd=cwd)
+                normal_procs = []
+                if self.num_clients > 1:
+                    normal_procs.append(clients[1].popen(
+                        f"python3 {HERE / 'loadgen.py'} --clients {self.num_clients - 1} --name normal --source {clients[1].IP()}", cwd=cwd))
+            else:
+                # Client 1 is rogue (batch size c)
+                rogue_proc = clients[0].popen(f"python3 {HERE / 'client.py'} --batch-size {c_value} --client-id rogue", cwd=cwd)
+                
+                # Clients 2-N are normal (batch size 1)
+                normal_procs = []
+                for i in range(1, self.num_clients):
+                    proc = clients[i].popen(f"python3 {HERE / 'client.py'} --batch-size 1 --client-id normal_{i+1}", cwd=cwd)
+                    normal_procs.append(proc)
+            procs.append(rogue_proc)
+            procs.extend(normal_procs)
             
             # Wait for all clients
             rogue_proc.wait()
@@ -106,26 +164,30 @@ class Runner:
             for i, normal_out in enumerate(normal_outs):
                 print(f"Client {i+1}, Output: {normal_out}")
             # Stop server
-            server_proc.terminate()
-            server_proc.wait()
-            time.sleep(2)
+            stop(server_proc)
+            if server_proc.kept:
+                print(f"Server queue (c={c_value}): {server_proc.kept[-1]}")
             
             # Parse results
-            time.sleep(1)
-            results = self.parse_logs()
+            results = self.parse_logs(log_dir)
+            self.parse_latency(c_value, log_dir)
             
             return results
             
         finally:
-            net.stop()
+            for proc in procs:
+                stop(proc)
         
 
     def run_varying_c(self):
         c_values = list(range(1, 11))
+        # every slot's hosts exist before the experiments start sharing the network
+        self.slots = max_parallel(self.parallel, len(c_values))
+        self.start_network()
+        sweep = run_sweep(c_values, lambda c, slot: self.run_experiment(c, slot), self.slots)
         jfi_results = {}
-        for c in c_values:
+        for c, completion_times in zip(c_values, sweep):
             print(f"\n--- Testing c = {c} ---")
-            completion_times = self.run_experiment(c)
             if completion_times:
                 jfi = self.calculate_jfi(completion_times)
                 jfi_results[c] = jfi
@@ -135,8 +197,11 @@ class Runner:
                 print(f"Experiment with c={c} failed.")
         print("\nAll experiments completed")
         self.plot_jfi_vs_c(jfi_results)
+        self.plot_latency_vs_c()
 
     def plot_jfi_vs_c(self, results):
+        # only plotting needs matplotlib, the experiments run without it
+        import matplotlib.pyplot as plt
         if not results:
             print("No results to plot.")
             return
@@ -156,25 +221,54 @@ class Runner:
         plt.savefig(plot_filename)
         print(f"\nPlot saved as {plot_filename}")
 
+    def plot_latency_vs_c(self):
+        """
+        request latency percentiles of all clients, from the merged histograms
+        """
+        import matplotlib.pyplot as plt
+        c_values = sorted(self.latency)
+        if not c_values:
+            return
+        plt.figure(figsize=(10, 6))
+        for name in ('p50', 'p90', 'p99', 'p99.9'):
+            plt.plot(c_values, [self.latency[c].percentiles()[name] / 1000 for c in c_values], marker='o', label=name)
+        plt.xlabel('Number of Parallel Requests by Greedy Client (c)')
+        plt.ylabel('Request latency (ms)')
+        plt.title('Request Latency Percentiles under FCFS Scheduling')
+        plt.grid(True, alpha=0.3)
+        plt.xticks(c_values)
+        plt.yscale('log')
+        plt.legend()
+        plot_filename = 'p3_latency.png'
+        plt.savefig(plot_filename)
+        print(f"Plot saved as {plot_filename}")
+
 def main():
     parser = argparse.ArgumentParser(description="Run FCFS fairness experiments on Mininet.")
     parser.add_argument('--single-run', action='store_true', help='Run a single experiment with c from config.json')
+    parser.add_argument('--loadgen', action='store_true', help='simulate the clients with loadgen.py on two hosts, allows num_clients in the thousands')
+    parser.add_argument('--parallel', type=int, default=1, help='experiments of the c sweep to run at once, each on its own hosts (capped at the CPU count)')
+    parser.add_argument('--backend', choices=BACKENDS, default='mininet', help='loopback runs the hosts as local processes on 127.0.0.x, without root (backend.py)')
     args = parser.parse_args()
-    runner = Runner()
-    if args.single_run:
-        completion_times = runner.run_experiment(runner.c)
-        if completion_times:
-            jfi = runner.calculate_jfi(completion_times)
-            print("\n=== Single Run Results ===")
-            print(f"Completion Times (s): {completion_times}")
-            print(f"Jain's Fairness Index: {jfi:.4f}")
+    if args.backend == 'mininet' and os.geteuid() != 0:
+        print("This script uses Mininet and must be run with sudo.")
+        sys.exit(1)
+    runner = Runner(loadgen=args.loadgen, parallel=args.parallel, backend=args.backend)
+    try:
+        if args.single_run:
+            completion_times = runner.run_experiment(runner.c)
+            if completion_times:
+                jfi = runner.calculate_jfi(completion_times)
+                print("\n=== Single Run Results ===")
+                print(f"Completion Times (s): {completion_times}")
+                print(f"Jain's Fairness Index: {jfi:.4f}")
+                print(runner.latency[runner.c].summary())
+            else:
+                print("Single run failed to produce results.")
         else:
-            print("Single run failed to produce results.")
-    else:
-        runner.run_varying_c()
+            runner.run_varying_c()
+    finally:
+        runner.stop_network()
 
 if __name__ == '__main__':
-    if os.geteuid() != 0:
-        print("This script uses Mininet and must be run with sudo.")
-        sys.exit(1)
     main()
\ No newline at end of file
@@ -1,75 +1,510 @@
+import os
 import socket
+import selectors
 import threading
 import json
 import time
-import queue
 import sys
+import argparse
+import signal
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+import aio_server
+from corpus import Corpus, ResponseCache, load_corpus, send_buffers
+from wire import RequestParser, reply, busy
+
+# queued after a client's last request, closes the socket once everything before it is sent
+CLOSE = object()
+
+# registered with the selector for the socket that wakes it when a paused client can be read again
+RESUME = object()
+
+class Refused:
+    """
+    a request turned away by admission control: it keeps its place in the
+    queue and a worker answers it BUSY, the reader never writes
+    """
+    __slots__ = ('request',)
+
+    def __init__(self, request):
+        self.request = request
+
+def admitted(request) -> bool:
+    return request is not None and not isinstance(request, Refused)
+
+class RequestQueue:
+    """
+    the FCFS queue of [client, seq, request] entries: one lock round trip adds
+    every request parsed from a read, or hands a worker up to a whole batch
+
+    it holds at most limit requests in all and client_limit per client (0 for
+    no bound); a request that does not fit is handled by policy
+        block        the reader waits for room, the client's TCP window fills
+                     up behind it (backpressure)
+        busy         the new request is queued as Refused, to be answered BUSY
+        drop_oldest  the client's oldest queued request, or the oldest of all
+                     when the whole queue is full, is made Refused instead
+    close markers (request None) and Refused entries are let in without
+    counting; what bounds them is the client's backlog (Client.backlog)
+    """
+    POLICIES = ('block', 'busy', 'drop_oldest')
+
+    def __init__(self, limit=0, client_limit=0, policy='block'):
+        self.items = deque()
+        lock = threading.Lock()
+        self.not_empty = threading.Condition(lock)
+        self.not_full = threading.Condition(lock)
+        self.limit = limit
+        self.client_limit = client_limit
+        self.policy = policy
+        # gauges: requests queued now and at most, and how often admission control kicked in
+        self.depth = 0
+        self.max_depth = 0
+        self.max_client_depth = 0
+        self.blocked = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def full(self, client) -> bool:
+        return bool((self.limit and self.depth >= self.limit)
+                    or (self.client_limit and len(client.queued) >= self.client_limit))
+
+    def drop_oldest(self, client):
+        """
+        refuses the oldest queued request to make room for one of client's
+        """
+        if self.client_limit and len(client.queued) >= self.client_limit:
+            entry = client.queued[0]
+        else:
+            entry = next(e for e in self.items if admitted(e[2]))
+        # the queue is FIFO, so the oldest entry overall is its client's oldest too
+        entry[0].queued.popleft()
+        entry[2] = Refused(entry[2])
+        self.depth -= 1
+        self.dropped += 1
+
+    def put(self, item):
+        self.put_many((item,))
+
+    def put_many(self, items):
+        with self.not_full:
+            for client, seq, request in items:
+                if request is not None and self.full(client):
+                    if self.policy == 'busy':
+                        self.rejected += 1
+                        self.items.append([client, seq, Refused(request)])
+                        continue
+                    if self.policy == 'drop_oldest':
+                        self.drop_oldest(client)
+                    else:
+                        self.blocked += 1
+                        # what is already in can be served while this reader waits
+                        self.not_empty.notify(len(self.items))
+                        while self.full(client):
+                            self.not_full.wait()
+                entry = [client, seq, request]
+                self.items.append(entry)
+                if request is not None:
+                    client.queued.append(entry)
+                    self.depth += 1
+                    self.max_depth = max(self.max_depth, self.depth)
+                    self.max_client_depth = max(self.max_client_depth, len(client.queued))
+            self.not_empty.notify(len(items))
+
+    def get_batch(self, max_items):
+        """
+        blocks until there is a request, then takes up to max_items in arrival order
+        """
+        with self.not_empty:
+            while not self.items:
+                self.not_empty.wait()
+            batch = []
+            while self.items and len(batch) < max_items:
+                entry = self.items.popleft()
+                if admitted(entry[2]):
+                    entry[0].queued.popleft()
+                    self.depth -= 1
+                batch.append(entry)
+            self.not_full.notify_all()
+            return batch
+
+    def gauges(self) -> str:
+        return (f"QUEUE depth={self.depth} max_depth={self.max_depth} max_client_depth={self.max_client_depth} "
+                f"limit={self.limit} client_limit={self.client_limit} policy={self.policy} "
+                f"blocked={self.blocked} busy={self.rejected} dropped={self.dropped}")
+
+class DispatchStats:
+    """
+    what answering the requests cost: wakeups of the workers and sendmsg calls,
+    counted by whichever thread makes them
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        # answered BUSY by admission control, their sends still count
+        self.refused = 0
+        self.batches = 0
+        self.sends = 0
+
+    def add(self, requests, refused=0):
+        """
+        one worker wakeup that answered requests and refused more (close
+        markers not included)
+        """
+        with self.lock:
+            self.requests += requests
+            self.refused += refused
+            self.batches += 1
+
+    def sent(self, calls):
+        with self.lock:
+            self.sends += calls
+
+    def summary(self) -> str:
+        per_request = self.sends / self.requests if self.requests else 0
+        per_batch = (self.requests + self.refused) / self.batches if self.batches else 0
+        return (f"Dispatch: {self.requests} requests and {self.refused} refused in {self.batches} batches "
+                f"({per_batch:.1f} per wakeup), {self.sends} sendmsg calls, {per_request:.3f} syscalls/request")
+
+class Client:
+    """
+    a connected socket as the dispatch workers see it: the thread reading it
+    numbers its requests in arrival order, and the replies leave in that order
+    whichever worker finishes first
+
+    backlog (0 for no bound) caps the requests read but not answered yet,
+    queued, refused or parked in done: past it the client is not read until
+    its replies drain, so one that sends without reading cannot grow the
+    server however the queue treats its requests
+    """
+    def __init__(self, sock, stats, backlog=0, on_drained=None):
+        self.sock = sock
+        self.stats = stats
+        self.backlog = backlog
+        self.next_seq = 0
+        self.lock = threading.Lock()
+        # notified as replies leave, for a reader waiting in wait_backlog
+        self.drained = threading.Condition(self.lock)
+        # set by pause(); on_drained(self) is called once the backlog is back under
+        self.paused = False
+        self.on_drained = on_drained
+        # seq -> reply buffers (or CLOSE) done but not sent yet
+        self.done = {}
+        self.next_send = 0
+        self.sending = False
+        # entries of this client still in the request queue, oldest first
+        self.queued = deque()
+
+    def number(self) -> int:
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def over_backlog(self) -> bool:
+        return bool(self.backlog) and self.next_seq - self.next_send >= self.backlog
+
+    def wait_backlog(self):
+        """
+        blocks the thread reading this client while it is over its backlog
+        """
+        with self.lock:
+            while self.over_backlog():
+                self.drained.wait()
+
+    def pause(self) -> bool:
+        """
+        for a reader that cannot wait: True if the client is over its backlog
+        and should not be read until on_drained is called
+        """
+        with self.lock:
+            self.paused = self.over_backlog()
+            return self.paused
+
+    def deliver(self, seq, buffers, count=1) -> None:
+        """
+        buffers answer the count requests from seq on. the worker that finds
+        the next reply in line sends it together with every reply done after
+        it, in one send_buffers; the others leave theirs in done and return at
+        once. the sendmsg calls go to stats
+        """
+        with self.lock:
+            self.done[seq] = (buffers, count)
+            if self.sending:
+                return
+            self.sending = True
+        calls = 0
+        while True:
+            out = []
+            close = False
+            with self.lock:
+                while self.next_send in self.done:
+                    buffers, count = self.done.pop(self.next_send)
+                    self.next_send += count
+                    if buffers is CLOSE:
+                        close = True
+                        break
+                    out.extend(buffers)
+                if not out and not close:
+                    self.sending = False
+                    self.stats.sent(calls)
+                    return
+                # replies moved on, the reader may be back under its backlog
+                resume = self.paused and not self.over_backlog()
+                if resume:
+                    self.paused = False
+                if self.backlog:
+                    self.drained.notify_all()
+            if resume:
+                self.on_drained(self)
+            if out:
+                try:
+                    calls += send_buffers(self.sock, out)
+                except (ConnectionResetError, BrokenPipeError):
+                    pass
+            if close:
+                self.sock.close()
 
 class FCFSServer:
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file='config.json', engine=None):
         with open(config_file, 'r') as f:
             self.config = json.load(f)
+        # "threads" (thread per client), "selector" (one thread reads every client) or "asyncio"
+        self.engine = engine or self.config.get('engine', 'threads')
         self.host = '0.0.0.0'
         self.port = self.config.get('server_port', 8887)
         self.filename = self.config.get('filename', 'words.txt')
+        # one cache for the server's lifetime, emptied whenever the words are reloaded (SIGHUP)
+        cache_bytes = self.config.get('cache_bytes', 0)
+        self.cache = ResponseCache(cache_bytes) if cache_bytes > 0 else None
         self.load_words()
-        self.request_queue = queue.Queue()
+        # bounded by queue_limit requests in all and client_queue_limit per client, 0 for no bound
+        self.request_queue = RequestQueue(self.config.get('queue_limit', 0), self.config.get('client_queue_limit', 0),
+                                          self.config.get('queue_policy', 'block'))
+        # threads taking requests off request_queue; they still dequeue in arrival order
+        self.dispatch_workers = self.config.get('dispatch_workers', 1)
+        # requests a worker takes per wakeup
+        self.dispatch_batch = self.config.get('dispatch_batch', 64)
+        self.stats = DispatchStats()
+        # unanswered requests after which a client is not read, 0 for twice its share of the queue
+        self.client_backlog = self.config.get('client_backlog', 0)
+        # seconds between queue gauge lines while serving, 0 prints them only at exit
+        self.stats_interval = self.config.get('stats_interval', 0)
 
     def load_words(self):
         try:
-            with open(self.filename, 'r') as f:
-                self.words = f.read().strip().split(',')
-                print(f"Loaded {len(self.words)} words.")
+            corpus = load_corpus(self.filename, self.config.get('corpus', 'memory'))
+            print(f"Loaded {corpus.describe()}.")
         except FileNotFoundError:
             print("words.txt not found.")
-            self.words = []
+            corpus = Corpus(b"")
+        if self.cache is not None:
+            corpus.attach_cache(self.cache)
+        # swapped in whole, requests already running finish on the old corpus
+        self.corpus = corpus
+
+    def reload_on_sighup(self):
+        """
+        SIGHUP rereads the words file. the handler only writes a byte to a
+        pipe; the reload runs on a thread of its own, so it never takes the
+        cache lock in signal context or raises into the interrupted code
+        """
+        wakeup, waker = os.pipe()
+        os.set_blocking(waker, False)
+
+        def on_sighup(signum, frame):
+            try:
+                os.write(waker, b"\0")
+            except BlockingIOError:
+                pass  # a reload is already pending
+
+        def reload():
+            while True:
+                # signals that arrived during one reload are served by the next
+                os.read(wakeup, 4096)
+                try:
+                    self.load_words()
+                except Exception as e:
+                    print(f"Reload of {self.filename} failed: {e}", flush=True)
+
+        threading.Thread(target=reload, daemon=True).start()
+        signal.signal(signal.SIGHUP, on_sighup)
+
+
+    def new_client(self, sock, on_drained=None) -> Client:
+        backlog = self.client_backlog or 2 * (self.request_queue.client_limit or self.request_queue.limit)
+        return Client(sock, self.stats, backlog, on_drained)
+
+    def answer(self, request) -> list:
+        if isinstance(request, Refused):
+            return busy(request.request)
+        return reply(self.corpus, request)
 
     def handle_client(self, client_socket, client_address):
         print(f"Client connected from {client_address}")
-        buffer = ""
+        parser = RequestParser()
+        client = self.new_client(client_socket)
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
+                client.wait_backlog()
+                data = client_socket.recv(65536)
                 if not data:
                     break
-                buffer += data
-                while '\n' in buffer:
-                    request, buffer = buffer.split('\n', 1)
-                    if request:
-                        self.request_queue.put((client_socket, request.strip()))
+                self.request_queue.put_many([(client, client.number(), request) for request in parser.feed(data)])
         except ConnectionResetError:
             pass 
             print(f"Client {client_address} disconnected.")
-            client_socket.close()
+        # closed by a worker once everything before it is answered
+        self.request_queue.put((client, client.number(), None))
+
+    def serve_selector(self, server_socket):
+        """
+        one thread reads every client instead of a thread each: requests go
+        into request_queue in the order this loop parses them, which is the
+        arrival order the per-client threads give as well. a client over its
+        backlog is unregistered until a worker hands it back through resumed,
+        this thread never waits on one client
+        """
+        sel = selectors.DefaultSelector()
+        server_socket.setblocking(False)
+        sel.register(server_socket, selectors.EVENT_READ, None)
+        wakeup, waker = socket.socketpair()
+        wakeup.setblocking(False)
+        waker.setblocking(False)
+        sel.register(wakeup, selectors.EVENT_READ, RESUME)
+        paused = {}  # client -> its parser
+        resumed = deque()
+
+        def on_drained(client):
+            resumed.append(client)
+            try:
+                waker.send(b"\0")
+            except BlockingIOError:
+                pass  # a wakeup is already pending
+
+        while True:
+            for key, _ in sel.select():
+                if key.data is RESUME:
+                    try:
+                        wakeup.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    while resumed:
+                        client = resumed.popleft()
+                        sel.register(client.sock, selectors.EVENT_READ, (client, paused.pop(client)))
+                    continue
+                if key.data is None:
+                    # drain the accept backlog in one go
+                    while True:
+                        try:
+                            client_socket, client_address = server_socket.accept()
+                        except BlockingIOError:
+                            break
+                        # only read when the selector says so, process_requests
+                        # keeps sending with blocking writes
+                        client_socket.setblocking(True)
+                        sel.register(client_socket, selectors.EVENT_READ, (self.new_client(client_socket, on_drained), RequestParser()))
+                        print(f"Client connected from {client_address}")
+                    continue
+
+                client_socket = key.fileobj
+                client, parser = key.data
+                try:
+                    data = client_socket.recv(65536)
+                except ConnectionResetError:
+                    data = b""
+                if not data:
+                    sel.unregister(client_socket)
+                    # closed by a worker once everything before it is answered
+                    self.request_queue.put((client, client.number(), None))
+                    continue
+                self.request_queue.put_many([(client, client.number(), request) for request in parser.feed(data)])
+                if client.pause():
+                    sel.unregister(client_socket)
+                    paused[client] = parser
 
     def process_requests(self):
+        """
+        takes requests a batch at a time; a run of consecutive requests from
+        one client is answered with a single delivery, so a greedy client's c
+        requests cost one sendmsg instead of c. nothing is reordered, FCFS
+        order is the order of the batch
+        """
         while True:
-            client_socket, request = self.request_queue.get()
-            try:
-                offset, count = map(int, request.split(','))
-                if offset >= len(self.words):
-                    response = "EOF\n"
-                else:
-                    end = min(offset + count, len(self.words))
-                    selected = self.words[offset:end]
-                    if end >= len(self.words):
-                        selected.append("EOF")
-                    response = ','.join(selected) + '\n'
-                client_socket.sendall(response.encode('utf-8'))
-            except (ValueError, ConnectionResetError):
-                pass
+            batch = self.request_queue.get_batch(self.dispatch_batch)
+            answered = refused = 0
+            for client, run in groupby(batch, key=itemgetter(0)):
+                run = list(run)
+                seq = run[0][1]
+                # the close marker can only be the last item of a client's run
+                requests = [request for _, _, request in run if request is not None]
+                if requests:
+                    buffers = [buf for request in requests for buf in self.answer(request)]
+                    client.deliver(seq, buffers, len(requests))
+                    refused += sum(isinstance(request, Refused) for request in requests)
+                    answered += len(requests)
+                if len(requests) < len(run):
+                    client.deliver(seq + len(requests), CLOSE)
+            self.stats.add(answered - refused, refused)
+
+    def report_queue(self):
+        while True:
+            time.sleep(self.stats_interval)
+            print(self.request_queue.gauges(), flush=True)
 
     def start(self):
+        if self.engine == 'asyncio':
+            aio_server.run(aio_server.corpus_responder(self), self.host, self.port, 'fcfs', self.config, name='FCFS')
+            return
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
-        server_socket.listen(50)
-        print(f"FCFS Server listening on port {self.port}")
-        threading.Thread(target=self.process_requests, daemon=True).start()
+        # loadgen.py opens thousands of connections at once
+        server_socket.listen(socket.SOMAXCONN)
+        print(f"FCFS Server listening on port {self.port}", flush=True)
+        for _ in range(self.dispatch_workers):
+            threading.Thread(target=self.process_requests, daemon=True).start()
+        if self.stats_interval > 0:
+            threading.Thread(target=self.report_queue, daemon=True).start()
+        if self.engine == 'selector':
+            self.serve_selector(server_socket)
+            return
         while True:
             client_socket, addr = server_socket.accept()
             threading.Thread(target=self.handle_client, args=(client_socket, addr), daemon=True).start()
 
 if __name__ == "__main__":
-    server = FCFSServer()
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="FCFS word server")
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--engine', choices=['threads', 'selector', 'asyncio'], default=None)
+    parser.add_argument('--dispatch-workers', type=int, default=None, help="threads answering queued requests, defaults to config['dispatch_workers'] or 1")
+    parser.add_argument('--dispatch-batch', type=int, default=None, help="requests a worker takes per wakeup, defaults to config['dispatch_batch'] or 64")
+    parser.add_argument('--queue-limit', type=int, default=None, help="requests queued from all clients, defaults to config['queue_limit'] or 0 (no bound)")
+    parser.add_argument('--client-queue-limit', type=int, default=None, help="requests queued from one client, defaults to config['client_queue_limit'] or 0 (no bound)")
+    parser.add_argument('--client-backlog', type=int, default=None, help="unanswered requests after which a client is not read, defaults to config['client_backlog'] or twice its queue share")
+    parser.add_argument('--queue-policy', choices=RequestQueue.POLICIES, default=None, help="what a full queue does with a request, defaults to config['queue_policy'] or block")
+    args = parser.parse_args()
+    server = FCFSServer(args.config, engine=args.engine)
+    if args.dispatch_workers:
+        server.dispatch_workers = args.dispatch_workers
+    if args.dispatch_batch:
+        server.dispatch_batch = args.dispatch_batch
+    if args.queue_limit is not None:
+        server.request_queue.limit = args.queue_limit
+    if args.client_queue_limit is not None:
+        server.request_queue.client_limit = args.client_queue_limit
+    if args.client_backlog is not None:
+        server.client_backlog = args.client_backlog
+    if args.queue_policy:
+        server.request_queue.policy = args.queue_policy
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # rereads the words file after it was edited or replaced, the old replies are dropped from the cache
+    server.reload_on_sighup()
+    try:
+        server.start()
+    finally:
+        if server.stats.requests or server.stats.refused:
+            print(server.stats.summary(), flush=True)
+            print(server.request_queue.gauges(), flush=True)
+        if server.cache is not None:
+            print(server.cache.summary(), flush=True)
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""
+runs independent sweep points of an experiment concurrently
+
+every running point holds a slot 0..parallel-1 that no other running point has,
+and keeps everything it touches inside that slot: its own hosts in the
+topology, its own server port, and its own working directory with a
+config.json and logs/. slot 0 is the part directory itself, so a sweep with
+parallel=1 reads and writes the same files as before.
+
+parallel is capped at the number of CPUs; beyond that the points would
+compete for the CPU and perturb each other's timings
+"""
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+# held while reading or writing the shared config.json
+CONFIG_LOCK = threading.Lock()
+
+
+def max_parallel(requested: int, n_points: int) -> int:
+    return max(1, min(requested, n_points, os.cpu_count() or 1))
+
+
+def run_sweep(points, run_point, parallel=1) -> list:
+    """
+    run_point(point, slot) for every point, at most parallel at a time;
+    results come back in the order of points
+    """
+    points = list(points)
+    parallel = max_parallel(parallel, len(points))
+    if parallel == 1:
+        return [run_point(point, 0) for point in points]
+
+    free = queue.SimpleQueue()
+    for slot in range(parallel):
+        free.put(slot)
+
+    def task(point):
+        slot = free.get()
+        try:
+            return run_point(point, slot)
+        finally:
+            free.put(slot)
+
+    with ThreadPoolExecutor(parallel) as pool:
+        return list(pool.map(task, points))
+
+
+def slot_host(slot: int, name: str, short: str = None) -> str:
+    """
+    topology name of host name in slot; slots past the first get their own
+    copies named slot<s><short> (short keeps mininet's interface names under
+    15 characters)
+    """
+    return name if slot == 0 else f"slot{slot}{short or name}"
+
+
+def slot_ip(slot: int, ip: str) -> str:
+    """
+    ip moved to the 10.0.<slot>.0/24 subnet of slot, slot 0 uses it as is
+    """
+    return ip if slot == 0 else f"10.0.{slot}.{ip.split('.')[-1]}"
+
+
+def slot_dir(slot: int, scratch: bool = False) -> Path:
+    """
+    working directory of slot, with its own config.json and logs/; with
+    scratch slot 0 gets one under slots/ too
+    """
+    path = HERE if slot == 0 and not scratch else HERE / "slots" / str(slot)
+    (path / "logs").mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_slot_config(slot: int, overrides: dict, scratch: bool = False) -> Path:
+    """
+    config.json of slot: the part's config.json with overrides applied. slot 0
+    edits it in place, and only if an override changes it, unless scratch
+    asks to leave it alone (the loopback backend, whose addresses are of no
+    use to a mininet run). filename is made absolute since the slot
+    directory has no words file of its own. returns the slot directory
+    """
+    path = slot_dir(slot, scratch)
+    with CONFIG_LOCK:
+        with open(HERE / "config.json") as f:
+            config = json.load(f)
+        if path == HERE and overrides.items() <= config.items():
+            return path
+        config.update(overrides)
+        if path != HERE:
+            config["filename"] = str(HERE / config.get("filename", "words.txt"))
+        with open(path / "config.json", "w") as f:
+            json.dump(config, f)
+    return path
@@ -7,41 +7,45 @@ from mininet.cli import CLI
 from mininet.log import setLogLevel
 from mininet.link import TCLink
 import json
+from sweep import slot_host, slot_ip
 
 # Default number of clients
 DEFAULT_CLIENTS = 10
 # =============================================================================
 
 class SimpleTopo(Topo):
-    def __init__(self, num_clients=DEFAULT_CLIENTS):
+    def __init__(self, num_clients=DEFAULT_CLIENTS, slots=1):
         Topo.__init__(self)
         
-        # Create switch
-        switch = self.addSwitch('s1', cls=OVSSwitch)
-        
         with open("config.json") as f:
             data = json.load(f)
 
         ip = data["server_ip"]
-        # Create server
-        server = self.addHost('server', ip=ip)
-        
-        # Create clients
-        clients = []
-        for i in range(num_clients):
-            client = self.addHost(f'client{i+1}', ip=f'10.0.0.{i+1}')
-            clients.append(client)
-        
-        # Connect server to switch with hardcoded bandwidth=1
-        self.addLink(server, switch, bw=1)
-        
-        # Connect all clients to switch with hardcoded bandwidth=1
-        for client in clients:
-            self.addLink(client, switch, bw=1)
+        # one switch per slot so parallel experiments do not share a link; slots
+        # past the first (sweep.py) get their own slot<s>srv and slot<s>c<i>
+        for slot in range(slots):
+            # Create switch
+            switch = self.addSwitch(f's{slot+1}', cls=OVSSwitch)
+            
+            # Create server
+            server = self.addHost(slot_host(slot, 'server', 'srv'), ip=slot_ip(slot, ip))
+            
+            # Create clients
+            clients = []
+            for i in range(num_clients):
+                client = self.addHost(slot_host(slot, f'client{i+1}', f'c{i+1}'), ip=slot_ip(slot, f'10.0.0.{i+1}'))
+                clients.append(client)
+            
+            # Connect server to switch with hardcoded bandwidth=1
+            self.addLink(server, switch, bw=1)
+            
+            # Connect all clients to switch with hardcoded bandwidth=1
+            for client in clients:
+                self.addLink(client, switch, bw=1)
 
-def create_network(num_clients=DEFAULT_CLIENTS):
+def create_network(num_clients=DEFAULT_CLIENTS, slots=1):
     """Create and start the network with hardcoded bandwidth=1 for all links"""
-    topo = SimpleTopo(num_clients)
+    topo = SimpleTopo(num_clients, slots)
     net = Mininet(topo=topo, switch=OVSSwitch, link=TCLink)
     net.start()
     return net
@@ -0,0 +1,220 @@
+"""
+request parsing shared by every server engine, plus the opt-in binary protocol
+
+text (default):   "p,k\n"  ->  "w1,...,wk\n" or "w1,...,wk,EOF\n" or "EOF\n"
+                  "COUNT p,k\n"  ->  "w1:c1,...,wm:cm[,EOF]\n", the frequency of
+                  every distinct word in the range instead of the words
+
+binary: the client sends the line "BIN1\n" as its first request and the server
+answers "BIN1\n" before any frame. after that every request is a fixed 16 byte
+header and every reply a 9 byte header followed by the words, comma separated,
+without the trailing ",EOF" (a flag carries it instead):
+
+    request   !IQI   request id, offset p, count k
+    response  !IIB   request id, payload length, flags (FLAG_EOF, FLAG_BUSY)
+
+COUNT is only available in the text protocol. a server doing admission
+control answers a request it turns away with "BUSY\n", or an empty binary
+reply flagged FLAG_BUSY
+"""
+import socket
+import struct
+
+MAGIC = b"BIN1"
+ACK = MAGIC + b"\n"
+REQUEST = struct.Struct("!IQI")
+RESPONSE = struct.Struct("!IIB")
+FLAG_EOF = 1
+FLAG_BUSY = 2
+BUSY = b"BUSY\n"
+
+# request tuples are (request id, p, k); text requests have no id, an
+# unparsable text line has p = None, the hello is answered with ACK and
+# COUNT requests carry the COUNT tag in place of the id
+HELLO = ("hello", 0, 0)
+INVALID = (None, None, None)
+COUNT = "count"
+COUNT_PREFIX = b"COUNT "
+
+
+class RequestParser:
+    """
+    incremental per-connection parser: feed() takes whatever recv returned and
+    gives back every complete request, keeping partial ones buffered
+    """
+    def __init__(self):
+        self.buf = bytearray()
+        self.binary = False
+
+    def feed(self, data: bytes) -> list:
+        self.buf += data
+        requests = []
+        start = 0
+        while not self.binary:
+            end = self.buf.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self.buf[start:end]).strip()
+            start = end + 1
+            if line == MAGIC:
+                self.binary = True
+                requests.append(HELLO)
+            elif line:
+                requests.append(parse_text(line))
+        if self.binary:
+            size = REQUEST.size
+            while len(self.buf) - start >= size:
+                requests.append(REQUEST.unpack_from(self.buf, start))
+                start += size
+        del self.buf[:start]
+        return requests
+
+
+def parse_text(line: bytes):
+    tag = None
+    if line.startswith(COUNT_PREFIX):
+        tag, line = COUNT, line[len(COUNT_PREFIX):]
+    try:
+        parts = line.split(b",")
+        return (tag, int(parts[0]), int(parts[1]))
+    except (ValueError, IndexError):
+        return INVALID
+
+
+def reply(corpus, request, invalid=()) -> list:
+    """
+    buffers answering request; invalid is sent for requests that cannot be served
+    """
+    rid, p, k = request
+    if request is HELLO:
+        return [ACK]
+    try:
+        if p is None:
+            raise ValueError("unparsable request")
+        if rid is None:
+            return corpus.response(p, k)
+        if rid == COUNT:
+            return corpus.count_response(p, k)
+        body, eof = corpus.slice(p, k)
+        return [RESPONSE.pack(rid, len(body), FLAG_EOF if eof else 0), body]
+    except ValueError:
+        return list(invalid)
+
+
+def busy(request) -> list:
+    """
+    buffers turning request away, in the protocol it came in
+    """
+    rid = request[0]
+    if isinstance(rid, int):
+        return [RESPONSE.pack(rid, 0, FLAG_BUSY)]
+    return [BUSY]
+
+
+def negotiate(sock, timeout=2.0) -> bool:
+    """
+    client side: asks for the binary protocol, True once the server agreed
+    """
+    sock.sendall(ACK)
+    previous = sock.gettimeout()
+    sock.settimeout(timeout)
+    try:
+        answer = b""
+        while not answer.endswith(b"\n"):
+            data = sock.recv(len(ACK) - len(answer))
+            if not data:
+                return False
+            answer += data
+        return answer == ACK
+    except socket.timeout:
+        return False
+    finally:
+        sock.settimeout(previous)
+
+
+class RecvBuffer:
+    """
+    client side receive buffer: recv_into a reused bytearray, consumed from
+    start; the unread tail is only moved to the front when the free space at
+    the end runs out, and the buffer only grows when one reply does not fit
+    """
+    def __init__(self, sock, size=1 << 16):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def recv_more(self) -> bool:
+        """
+        one recv_into after the data already buffered, False on EOF
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            pending = self.end - self.start
+            if self.start:
+                self.buf[:pending] = self.buf[self.start:self.end]
+                self.start, self.end = 0, pending
+            if pending == len(self.buf):
+                self.buf.extend(bytes(len(self.buf)))
+        n = self.sock.recv_into(memoryview(self.buf)[self.end:])
+        if n == 0:
+            return False
+        self.end += n
+        return True
+
+    def fill(self, need: int) -> bool:
+        """
+        makes at least need bytes available from start, False on EOF
+        """
+        while self.end - self.start < need:
+            if len(self.buf) - self.start < need and self.start:
+                # the frame would run past the end, compact first
+                pending = self.end - self.start
+                self.buf[:pending] = self.buf[self.start:self.end]
+                self.start, self.end = 0, pending
+            if len(self.buf) < need:
+                self.buf.extend(bytes(need - len(self.buf)))
+            if not self.recv_more():
+                return False
+        return True
+
+
+class LineReader(RecvBuffer):
+    """
+    text replies: every byte is scanned for the newline once, however many
+    recv calls a reply spans or however many replies one recv returns
+    """
+    def read_line(self):
+        """
+        the next reply without its newline, None on EOF
+        """
+        scanned = 0  # bytes after start already known not to hold a newline
+        while True:
+            end = self.buf.find(b"\n", self.start + scanned, self.end)
+            if end >= 0:
+                line = bytes(self.buf[self.start:end])
+                self.start = end + 1
+                return line
+            scanned = self.end - self.start
+            if not self.recv_more():
+                return None
+
+
+class FrameReader(RecvBuffer):
+    """
+    binary replies: struct.unpack_from the headers in place
+    """
+    def read_frame(self):
+        """
+        (request id, flags, payload bytes) of the next reply, None on EOF
+        """
+        if not self.fill(RESPONSE.size):
+            return None
+        rid, length, flags = RESPONSE.unpack_from(self.buf, self.start)
+        if not self.fill(RESPONSE.size + length):
+            return None
+        body_start = self.start + RESPONSE.size
+        payload = bytes(self.buf[body_start:body_start + length])
+        self.start = body_start + length
+        return rid, flags, payload
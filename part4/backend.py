@@ -0,0 +1,68 @@
+"""
+where the experiment runners run their hosts
+
+"mininet" is the part's topology in Mininet, as before, and needs root.
+"loopback" needs neither root nor Mininet: every host is the runner's own
+subprocesses with an address of its own on 127.0.0.0/8, so the same config
+can be benchmarked on any machine in seconds, at loopback speed (no link
+bandwidth or delay). both give the runners the part of the Mininet API they
+use
+
+    net.start(); host = net.get(name); host.IP(); host.popen(cmd, cwd=...);
+    host.cmd(cmd); net.stop()
+
+loopback hosts share one network namespace: servers running at the same time
+need ports of their own, and the config the clients read has to carry the
+server host's IP() rather than config['server_ip']
+"""
+import subprocess
+import threading
+
+BACKENDS = ("mininet", "loopback")
+
+
+class LoopbackHost:
+    def __init__(self, name, ip):
+        self.name = name
+        self.ip = ip
+
+    def IP(self):
+        return self.ip
+
+    def popen(self, cmd, **kwargs):
+        """
+        like mininet's Node.popen: a string cmd is split on whitespace and run
+        without a shell, stdout and stderr are pipes unless given
+        """
+        params = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE}
+        params.update(kwargs)
+        return subprocess.Popen(cmd.split() if isinstance(cmd, str) else cmd, **params)
+
+    def cmd(self, cmd):
+        """
+        like mininet's Node.cmd: runs cmd in a shell and returns its output
+        """
+        return subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode(errors="replace")
+
+
+class LoopbackNet:
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def get(self, name):
+        """
+        the host called name, created on first use with the next address of
+        127.0.0.2, 127.0.0.3, ... (the whole /8 is routed to lo on linux)
+        """
+        with self.lock:
+            if name not in self.hosts:
+                n = len(self.hosts) + 1
+                self.hosts[name] = LoopbackHost(name, f"127.0.{n // 254}.{n % 254 + 1}")
+            return self.hosts[name]
+
+    def stop(self):
+        pass
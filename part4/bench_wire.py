@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+text vs binary protocol microbenchmark, no network involved
+
+for the same stream of requests it times
+    parse   server side RequestParser.feed over 64 KiB chunks
+    reply   server side reply() building the response buffers
+    decode  client side reading every reply back out of a socketpair
+and prints the cost per request in microseconds.
+
+    python3 bench_wire.py --requests 200000 --k 5 50
+"""
+import argparse
+import socket
+import threading
+import time
+
+from corpus import Corpus
+from wire import ACK, HELLO, REQUEST, FrameReader, LineReader, RequestParser, reply
+
+CHUNK = 64 * 1024
+
+
+def request_stream(binary, n, k, n_words):
+    offsets = [(i * k) % n_words for i in range(n)]
+    if binary:
+        # the hello line switches the parser to binary frames
+        return ACK + b"".join(REQUEST.pack(i, p, k) for i, p in enumerate(offsets))
+    return b"".join(f"{p},{k}\n".encode() for p in offsets)
+
+
+def time_parse(stream):
+    parser = RequestParser()
+    start = time.perf_counter()
+    requests = []
+    for i in range(0, len(stream), CHUNK):
+        requests.extend(parser.feed(stream[i:i + CHUNK]))
+    elapsed = time.perf_counter() - start
+    return elapsed, [request for request in requests if request is not HELLO]
+
+
+def time_reply(corpus, requests):
+    start = time.perf_counter()
+    replies = [reply(corpus, request) for request in requests]
+    return time.perf_counter() - start, b"".join(b"".join(bytes(b) for b in r) for r in replies)
+
+
+def time_decode(binary, payload, n):
+    """
+    reads n replies the way the clients do, payload is written by a thread
+    """
+    reader_sock, writer_sock = socket.socketpair()
+    writer = threading.Thread(target=writer_sock.sendall, args=(payload,))
+    writer.start()
+    words = 0
+    start = time.perf_counter()
+    if binary:
+        frames = FrameReader(reader_sock)
+        for _ in range(n):
+            _, flags, body = frames.read_frame()
+            words += len(body.split(b","))
+    else:
+        lines = LineReader(reader_sock)
+        for _ in range(n):
+            line = lines.read_line()
+            words += len([w for w in line.split(b",") if w and w != b"EOF"])
+    elapsed = time.perf_counter() - start
+    writer.join()
+    reader_sock.close()
+    writer_sock.close()
+    return elapsed, words
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text vs binary wire protocol microbenchmark")
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 50])
+    parser.add_argument("--words", default="words.txt")
+    args = parser.parse_args()
+
+    corpus = Corpus.load(args.words)
+    n = args.requests
+    print("protocol,k,parse_us,reply_us,decode_us,request_bytes,reply_bytes")
+    for k in args.k:
+        for binary in (False, True):
+            stream = request_stream(binary, n, k, len(corpus))
+            parse_s, requests = time_parse(stream)
+            assert len(requests) == n
+            reply_s, payload = time_reply(corpus, requests)
+            decode_s, _ = time_decode(binary, payload, n)
+            name = "binary" if binary else "text"
+            print(f"{name},{k},{parse_s / n * 1e6:.3f},{reply_s / n * 1e6:.3f},{decode_s / n * 1e6:.3f},"
+                  f"{len(stream) / n:.1f},{len(payload) / n:.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
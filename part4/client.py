@@ -7,10 +7,12 @@ import time
 import sys
 import argparse
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
+from latency import LatencyHistogram
+from wire import REQUEST, FLAG_EOF, FrameReader, LineReader, negotiate
 
 class WordCountClient:
-    def __init__(self, config_file='config.json', client_id=1, is_greedy=False, greedy_requests=1):
+    def __init__(self, config_file='config.json', client_id=1, is_greedy=False, greedy_requests=1, binary=False, count_mode=False):
         with open(config_file, 'r') as f:
             self.config = json.load(f)
         self.server_ip = self.config.get('server_ip', '10.0.0.100')
@@ -19,53 +21,88 @@ class WordCountClient:
         self.client_id = client_id
         self.is_greedy = is_greedy
         self.greedy_requests = greedy_requests
+        self.binary = binary
+        # ask for "COUNT p,k" histograms instead of the words themselves (text protocol only)
+        self.count_mode = count_mode
         self.word_count = defaultdict(int)
+        # one latency per reply, measured from the send of its request
+        self.latency = LatencyHistogram()
+        self.sent_at = deque()
         self.start_time = None
         self.end_time = None
 
+    def send_request(self, client_socket, index, binary):
+        if binary:
+            client_socket.sendall(REQUEST.pack(index, index * self.k, self.k))
+        else:
+            prefix = "COUNT " if self.count_mode else ""
+            request = f"{prefix}{index * self.k},{self.k}\n"
+            client_socket.sendall(request.encode('utf-8'))
+        self.sent_at.append(time.time())
+
+    def add_counts(self, response):
+        """
+        adds a "word:count,..." reply to word_count, returns how many words it covered
+        """
+        covered = 0
+        for item in response.split(','):
+            if item and item != 'EOF':
+                word, count = item.rsplit(':', 1)
+                self.word_count[word] += int(count)
+                covered += int(count)
+        return covered
+
     def download_file(self):
         self.start_time = time.time()
         all_words = []
+        words_counted = 0
         words_to_get = 200 
         
         try:
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.connect((self.server_ip, self.server_port))
-            
+            binary = self.binary and not self.count_mode and negotiate(client_socket)
+            reader = FrameReader(client_socket) if binary else LineReader(client_socket)
             
             num_initial_requests = self.greedy_requests if self.is_greedy else 1
             for i in range(num_initial_requests):
-                request = f"{i * self.k},{self.k}\n"
-                client_socket.sendall(request.encode('utf-8'))
+                self.send_request(client_socket, i, binary)
             
             requests_sent = num_initial_requests
             
-            response_buffer = ""
-            while len(all_words) < words_to_get:
+            while len(all_words) + words_counted < words_to_get:
                 
-                while '\n' not in response_buffer:
-                    data = client_socket.recv(1024).decode('utf-8')
-                    if not data:
+                if binary:
+                    frame = reader.read_frame()
+                    if frame is None:
+                        break
+                    _, flags, payload = frame
+                    response = payload.decode('utf-8')
+                    eof = flags & FLAG_EOF
+                else:
+                    line = reader.read_line()
+                    if line is None:
                         break
-                    response_buffer += data
-                
-                if not response_buffer:
-                    break
 
-                response, response_buffer = response_buffer.split('\n', 1)
+                    response = line.decode('utf-8')
+                    eof = "EOF" in response
+                self.latency.record(time.time() - self.sent_at.popleft())
                 print(response)
-                if "EOF" in response:
+                if self.count_mode:
+                    words_counted += self.add_counts(response)
+                    if eof:
+                        break
+                elif eof:
                     words = [w for w in response.split(',') if w and w != 'EOF']
                     all_words.extend(words)
                     break 
-                
-                words = [w for w in response.split(',') if w]
-                all_words.extend(words)
+                else:
+                    words = [w for w in response.split(',') if w]
+                    all_words.extend(words)
 
                 
-                if len(all_words) < words_to_get:
-                    request = f"{requests_sent * self.k},{self.k}\n"
-                    client_socket.sendall(request.encode('utf-8'))
+                if len(all_words) + words_counted < words_to_get:
+                    self.send_request(client_socket, requests_sent, binary)
                     requests_sent += 1
 
             client_socket.close()
@@ -90,16 +127,22 @@ class WordCountClient:
                 os.makedirs(log_dir)
             with open(f"{log_dir}/{self.client_id}.log", "w") as f:
                 f.write(str(completion_time))
+            with open(f"{log_dir}/{self.client_id}.hist", "w") as f:
+                f.write(f"{self.latency.dumps()}\n{self.latency.summary()}\n")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Word Count Client")
     parser.add_argument('--client-id', type=str, default='client1')
     parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--binary', action='store_true', help='use the binary protocol (see wire.py)')
+    parser.add_argument('--count', action='store_true', help='request per-range word counts (COUNT p,k) instead of words')
     args = parser.parse_args()
     client = WordCountClient(
         client_id=args.client_id,
         is_greedy=(args.batch_size > 1),
-        greedy_requests=args.batch_size
+        greedy_requests=args.batch_size,
+        binary=args.binary,
+        count_mode=args.count
     )
     if client.download_file():
         client.log_results()
\ No newline at end of file
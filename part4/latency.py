@@ -0,0 +1,136 @@
+"""
+per-request latency histograms
+
+log-bucketed like HdrHistogram: latencies are recorded in microseconds,
+values below SUB_BUCKETS get a bucket each and above that every power of two
+is split into SUB_BUCKETS / 2 buckets, so a reported percentile is within
+2 / SUB_BUCKETS (about 1.6%) of the true value. the counts live in one
+array('Q'); histograms from several clients or runs are merged by adding them.
+
+clients print (or write to logs/<id>.hist) one line
+
+    LATENCY_HIST:<bucket>:<count>,<bucket>:<count>,...,max:<us>
+
+which parse() reads back, and a summary line
+
+    LATENCY_US n=... p50=... p90=... p99=... p99.9=... max=...
+
+the same bucketing is used by the part1 C++ client
+"""
+import math
+import re
+from array import array
+
+SUB_BITS = 7
+SUB_BUCKETS = 1 << SUB_BITS
+HALF = SUB_BUCKETS // 2
+# largest recordable latency is 2**MAX_BITS us (about 12 days)
+MAX_BITS = 40
+N_BUCKETS = (MAX_BITS - SUB_BITS + 2) * HALF
+
+PERCENTILES = (50, 90, 99, 99.9)
+HIST_PREFIX = "LATENCY_HIST:"
+
+
+def bucket_of(us: int) -> int:
+    bits = us.bit_length()
+    if bits <= SUB_BITS:
+        return us
+    shift = bits - SUB_BITS
+    return min(shift * HALF + (us >> shift), N_BUCKETS - 1)
+
+
+def bucket_value(index: int) -> int:
+    """
+    highest latency (us) that falls in bucket index
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // HALF - 1
+    return ((index - shift * HALF + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * N_BUCKETS))
+        self.total = 0
+        self.max_us = 0
+
+    def record(self, seconds: float) -> None:
+        us = max(int(seconds * 1e6), 0)
+        self.counts[bucket_of(us)] += 1
+        self.total += 1
+        if us > self.max_us:
+            self.max_us = us
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.total += other.total
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, q: float) -> int:
+        """
+        latency (us) at or below which q percent of the requests completed
+        """
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(self.total * q / 100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bucket_value(i), self.max_us)
+        return self.max_us
+
+    def percentiles(self) -> dict:
+        result = {f"p{q:g}": self.percentile(q) for q in PERCENTILES}
+        result["max"] = self.max_us
+        return result
+
+    def summary(self) -> str:
+        values = " ".join(f"{name}={us}" for name, us in self.percentiles().items())
+        return f"LATENCY_US n={self.total} {values}"
+
+    def dumps(self) -> str:
+        """
+        the sparse text form read back by parse(); the max rides along as a
+        bucket-less "max" entry so merged histograms keep the exact maximum
+        """
+        items = ",".join(f"{i}:{n}" for i, n in enumerate(self.counts) if n)
+        return f"{HIST_PREFIX}{items},max:{self.max_us}"
+
+    @classmethod
+    def parse(cls, line: str) -> "LatencyHistogram":
+        hist = cls()
+        for item in line.strip()[len(HIST_PREFIX):].split(","):
+            if not item:
+                continue
+            index, n = item.split(":")
+            if index == "max":
+                hist.max_us = max(hist.max_us, int(n))
+                continue
+            hist.counts[int(index)] += int(n)
+            hist.total += int(n)
+        return hist
+
+
+def from_output(text: str) -> LatencyHistogram:
+    """
+    merges every LATENCY_HIST line in a client's output
+    """
+    merged = LatencyHistogram()
+    for line in re.findall(rf"^{HIST_PREFIX}.*$", text, re.MULTILINE):
+        merged.merge(LatencyHistogram.parse(line))
+    return merged
+
+
+def merge_files(paths) -> LatencyHistogram:
+    merged = LatencyHistogram()
+    for path in paths:
+        with open(path) as f:
+            merged.merge(from_output(f.read()))
+    return merged
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+many word-count clients in one process
+
+every logical client is a coroutine doing what client.py does: keep
+--batch-size "p,k\\n" requests in flight (1 for a normal client, c for a greedy
+one) until it has words_to_get words or sees EOF, then write its completion time
+to logs/<client id>.log. one interpreter for all of them instead of one
+`python3 client.py` per client, so runs with thousands of clients fit on a host.
+
+    python3 loadgen.py --clients 999 --name normal --source 10.0.0.2
+    python3 loadgen.py --clients 1 --batch-size 10 --name rogue
+
+prints one "<client id> ELAPSED_MS:<ms>" line per client, then the request
+latencies of all clients merged into one histogram (latency.py), which also goes
+to logs/<name>.hist
+
+--timing picks what ELAPSED_MS measures, to match the client.py it stands in
+for: "completion" (the default) runs from before connect to the last reply,
+like the part3/part4 clients' completion time; "download" runs from the first
+request sent to the last reply, like ELAPSED_MS of part2/client.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import time
+from collections import deque
+
+from latency import LatencyHistogram
+
+WORDS_TO_GET = 200
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+TIMINGS = ("completion", "download")
+
+
+async def run_client(host, port, p, k, window, words_to_get, hist, source=None, timing="completion"):
+    """
+    one client, returns its completion or download time in seconds (see
+    --timing) or None when the connection fails
+    """
+    start = time.time()
+    try:
+        reader, writer = await asyncio.open_connection(
+            host, port, local_addr=(source, 0) if source else None,
+        )
+    except OSError:
+        return None
+    if timing == "download":
+        start = time.time()
+
+    words = 0
+    requests_sent = 0
+    sent_at = deque()
+    # offsets of the requests in flight, oldest first, to resend one refused BUSY
+    offsets = deque(p + i * k for i in range(window))
+    try:
+        writer.write(b"".join(f"{offset},{k}\n".encode() for offset in offsets))
+        sent_at.extend([time.time()] * window)
+        requests_sent = window
+        while not words_to_get or words < words_to_get:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError:
+                return None
+            hist.record(time.time() - sent_at.popleft())
+            offset = offsets.popleft()
+            if line == b"BUSY\n":
+                # the server's queue was full, ask again
+                writer.write(f"{offset},{k}\n".encode())
+                sent_at.append(time.time())
+                offsets.append(offset)
+                continue
+            items = line[:-1].split(b",")
+            words += sum(1 for w in items if w and w != b"EOF")
+            if items[-1] == b"EOF":
+                break
+            if not words_to_get or requests_sent * k < words_to_get:
+                writer.write(f"{p + requests_sent * k},{k}\n".encode())
+                sent_at.append(time.time())
+                offsets.append(p + requests_sent * k)
+                requests_sent += 1
+    except (ConnectionError, OSError):
+        return None
+    finally:
+        writer.close()
+    return time.time() - start
+
+
+async def run_clients(config, args, hist):
+    host = config.get("server_ip", "10.0.0.100")
+    port = config.get("server_port", 8887)
+    k = config.get("k", 5)
+    p = config.get("p", 0)
+    if args.clients == 1:
+        client_ids = [args.name]
+    else:
+        client_ids = [f"{args.name}_{i + 1}" for i in range(args.clients)]
+    times = await asyncio.gather(*(
+        run_client(host, port, p, k, args.batch_size, args.words, hist, args.source, args.timing) for _ in client_ids
+    ))
+    return dict(zip(client_ids, times))
+
+
+def log_results(times, hist, name, log_dir="logs"):
+    """
+    same .log files as WordCountClient.log_results, failed clients write none;
+    the histogram covers every client of this run
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    for client_id, completion_time in times.items():
+        if completion_time is not None:
+            with open(f"{log_dir}/{client_id}.log", "w") as f:
+                f.write(str(completion_time))
+    with open(f"{log_dir}/{name}.hist", "w") as f:
+        f.write(f"{hist.dumps()}\n{hist.summary()}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many word-count clients as coroutines in one process")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--clients", type=int, default=1, help="logical clients to run")
+    parser.add_argument("--batch-size", type=int, default=1, help="requests each client keeps in flight")
+    parser.add_argument("--name", default="client", help="client id, numbered as <name>_<i> for several clients")
+    parser.add_argument("--source", default=None, help="local address to connect from (this host's IP)")
+    parser.add_argument("--words", type=int, default=WORDS_TO_GET, help="words each client downloads, 0 for the whole file")
+    parser.add_argument("--timing", choices=TIMINGS, default="completion", help="what ELAPSED_MS measures, see above")
+    parser.add_argument("--log-dir", default="logs", help="where <client id>.log files go, '' for none")
+    args = parser.parse_args()
+    with open(args.config) as f:
+        config = json.load(f)
+
+    raise_fd_limit()
+    hist = LatencyHistogram()
+    times = asyncio.run(run_clients(config, args, hist))
+    for client_id, completion_time in times.items():
+        if completion_time is None:
+            print(f"{client_id} FAILED")
+        else:
+            print(f"{client_id} ELAPSED_MS:{completion_time * 1000}")
+    print(hist.summary())
+    print(hist.dumps())
+    if args.log_dir:
+        log_results(times, hist, args.name, args.log_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+server start/stop for the experiment runners without fixed sleeps
+
+every server prints a "... listening on ..." line once its socket accepts
+connections; wait_ready() returns as soon as that line shows up on the
+server's stdout, and stop() returns as soon as the process has exited
+"""
+import re
+import subprocess
+import threading
+
+READY = re.compile(rb"listening on", re.IGNORECASE)
+
+
+def wait_ready(proc, timeout=10.0, echo=False, keep=None) -> bool:
+    """
+    blocks until proc prints its ready line, False if it exits or times out
+    first. proc must have been started with stdout=PIPE (the mininet popen
+    default); a daemon thread keeps draining it afterwards so a chatty server
+    never blocks on a full pipe. lines matching the regex keep are collected
+    in proc.kept, complete once stop(proc) has returned
+    """
+    ready = threading.Event()
+    listening = []
+    proc.kept = []
+
+    def drain():
+        for line in iter(proc.stdout.readline, b""):
+            if echo:
+                print(line.decode(errors="replace"), end="", flush=True)
+            if keep is not None and re.search(keep, line.decode(errors="replace")):
+                proc.kept.append(line.decode(errors="replace").rstrip("\n"))
+            if not listening and READY.search(line):
+                listening.append(line)
+                ready.set()
+        # stdout closed: the server is gone, wake the waiter up
+        ready.set()
+
+    proc.drainer = threading.Thread(target=drain, daemon=True)
+    proc.drainer.start()
+    ready.wait(timeout)
+    return bool(listening) and proc.poll() is None
+
+
+def stop(proc, timeout=5.0) -> None:
+    """
+    SIGTERM, then SIGKILL if proc has not exited after timeout seconds
+    """
+    if proc.poll() is None:
+        proc.terminate()
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    # let wait_ready's reader take the last lines (children may hold the pipe open)
+    drainer = getattr(proc, "drainer", None)
+    if drainer is not None:
+        drainer.join(1.0)
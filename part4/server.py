@@ -1,112 +1,172 @@
 
+import os
 import socket
 import threading
 import json
-import time
-import queue
 import sys
+import argparse
+import signal
+import aio_server
+from corpus import Corpus, ResponseCache, load_corpus, send_buffers
+from wire import RequestParser, reply
 from collections import deque
 
+class ActiveSet:
+    """
+    per-client request queues and the round robin over them: active holds the
+    clients with requests pending, one entry each, in turn order. a client
+    goes to the back after every request it is served and leaves the rotation
+    when its queue runs dry, so the scheduler only visits backlogged clients
+    and sleeps on a condition variable while there are none
+    """
+    def __init__(self):
+        self.queues = {}
+        self.active = deque()
+        self.ready = threading.Condition()
+
+    def add(self, client_id):
+        with self.ready:
+            self.queues[client_id] = deque()
+
+    def remove(self, client_id):
+        """
+        drops client_id and whatever it still had queued; its entry in active,
+        if any, is skipped when it comes up (ids are never reused)
+        """
+        with self.ready:
+            self.queues.pop(client_id, None)
+
+    def put_many(self, client_id, requests):
+        with self.ready:
+            pending = self.queues.get(client_id)
+            if pending is None or not requests:
+                return
+            if not pending:
+                self.active.append(client_id)
+                self.ready.notify()
+            pending.extend(requests)
+
+    def get(self):
+        """
+        blocks until a client has a request, returns (client_id, request) for
+        the next one in turn
+        """
+        with self.ready:
+            while True:
+                while not self.active:
+                    self.ready.wait()
+                client_id = self.active.popleft()
+                pending = self.queues.get(client_id)
+                if pending:
+                    break
+            request = pending.popleft()
+            if pending:
+                self.active.append(client_id)
+            return client_id, request
+
 class RoundRobinServer:
-    def __init__(self, config_file='config.json'):
+    def __init__(self, config_file='config.json', engine=None):
         with open(config_file, 'r') as f:
             self.config = json.load(f)
+        # "threads" (thread per client) or "asyncio"
+        self.engine = engine or self.config.get('engine', 'threads')
         
         self.host = '0.0.0.0' 
         self.port = self.config.get('server_port', 12345)
         self.filename = self.config.get('filename', 'words.txt')
+        # one cache for the server's lifetime, emptied whenever the words are reloaded (SIGHUP)
+        cache_bytes = self.config.get('cache_bytes', 0)
+        self.cache = ResponseCache(cache_bytes) if cache_bytes > 0 else None
         self.load_words()
 
-      
-        self.client_queues = {}  
-        self.client_order = deque()  
+        # requests waiting per client, and the clients that have any
+        self.active_set = ActiveSet()
         self.clients_lock = threading.Lock()
         self.client_counter = 0
         self.client_sockets = {} 
 
     def load_words(self):
         try:
-            with open(self.filename, 'r') as f:
-                self.words = f.read().strip().split(',')
-                print(f"Loaded {len(self.words)} words from {self.filename}")
+            corpus = load_corpus(self.filename, self.config.get('corpus', 'memory'))
+            print(f"Loaded {corpus.describe()} from {self.filename}")
         except FileNotFoundError:
-            self.words = ['error'] * 100
+            corpus = Corpus(b",".join([b"error"] * 100))
             print(f"Warning: {self.filename} not found.")
+        if self.cache is not None:
+            corpus.attach_cache(self.cache)
+        # swapped in whole, requests already running finish on the old corpus
+        self.corpus = corpus
+
+    def reload_on_sighup(self):
+        """
+        SIGHUP rereads the words file. the handler only writes a byte to a
+        pipe; the reload runs on a thread of its own, so it never takes the
+        cache lock in signal context or raises into the interrupted code
+        """
+        wakeup, waker = os.pipe()
+        os.set_blocking(waker, False)
+
+        def on_sighup(signum, frame):
+            try:
+                os.write(waker, b"\0")
+            except BlockingIOError:
+                pass  # a reload is already pending
+
+        def reload():
+            while True:
+                # signals that arrived during one reload are served by the next
+                os.read(wakeup, 4096)
+                try:
+                    self.load_words()
+                except Exception as e:
+                    print(f"Reload of {self.filename} failed: {e}", flush=True)
+
+        threading.Thread(target=reload, daemon=True).start()
+        signal.signal(signal.SIGHUP, on_sighup)
+
 
     def handle_client(self, client_socket, client_address):
         with self.clients_lock:
             self.client_counter += 1
             client_id = self.client_counter
             self.client_sockets[client_id] = client_socket
-            self.client_queues[client_id] = queue.Queue()
-            self.client_order.append(client_id)
+            self.active_set.add(client_id)
             print(f"Client {client_id} connected from {client_address}")
 
-        buffer = ""
+        parser = RequestParser()
         try:
             while True:
-                data = client_socket.recv(1024).decode('utf-8')
+                data = client_socket.recv(65536)
                 if not data:
                     break
-                buffer += data
-                while '\n' in buffer:
-                    request, buffer = buffer.split('\n', 1)
-                    if request:
-                        with self.clients_lock:
-                            if client_id in self.client_queues:
-                                self.client_queues[client_id].put(request.strip())
+                self.active_set.put_many(client_id, parser.feed(data))
         finally:
+            self.active_set.remove(client_id)
             with self.clients_lock:
-                if client_id in self.client_queues:
-                    del self.client_queues[client_id]
                 if client_id in self.client_sockets:
                     del self.client_sockets[client_id]
-                
-                temp_order = list(self.client_order)
-                if client_id in temp_order:
-                    temp_order.remove(client_id)
-                    self.client_order = deque(temp_order)
             client_socket.close()
             print(f"Client {client_id} disconnected.")
 
     def round_robin_scheduler(self):
         while True:
-            with self.clients_lock:
-                if not self.client_order:
-                    time.sleep(0.01)
-                    continue
-                
-                client_id = self.client_order.popleft()
-                self.client_order.append(client_id)
-            
-            try:
-                
-                request = self.client_queues[client_id].get_nowait()
-            except (queue.Empty, KeyError):
-                continue
-            
+            client_id, request = self.active_set.get()
             try:
                 client_socket = self.client_sockets[client_id]
-                offset, count = map(int, request.split(','))
-                
-                if offset >= len(self.words):
-                    response = "EOF\n"
-                else:
-                    end = min(offset + count, len(self.words))
-                    selected = self.words[offset:end]
-                    if end >= len(self.words):
-                        selected.append("EOF")
-                    response = ','.join(selected) + '\n'
-                client_socket.sendall(response.encode('utf-8'))
-            except (ValueError, KeyError, ConnectionResetError):
+                send_buffers(client_socket, reply(self.corpus, request))
+            except (KeyError, ConnectionResetError, BrokenPipeError):
                 continue
 
     def start(self):
+        if self.engine == 'asyncio':
+            aio_server.run(aio_server.corpus_responder(self), self.host, self.port, 'rr', self.config, name='Round-Robin')
+            return
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_socket.bind((self.host, self.port))
-        server_socket.listen(50)
-        print(f"Round-Robin Server listening on port {self.port}")
+        # loadgen.py opens thousands of connections at once
+        server_socket.listen(socket.SOMAXCONN)
+        print(f"Round-Robin Server listening on port {self.port}", flush=True)
         
         scheduler_thread = threading.Thread(target=self.round_robin_scheduler, daemon=True)
         scheduler_thread.start()
@@ -122,5 +182,16 @@ class RoundRobinServer:
             server_socket.close()
 
 if __name__ == "__main__":
-    server = RoundRobinServer()
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Round-Robin word server")
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default=None)
+    args = parser.parse_args()
+    server = RoundRobinServer(args.config, engine=args.engine)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # rereads the words file after it was edited or replaced, the old replies are dropped from the cache
+    server.reload_on_sighup()
+    try:
+        server.start()
+    finally:
+        if server.cache is not None:
+            print(server.cache.summary(), flush=True)
\ No newline at end of file